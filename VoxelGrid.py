@@ -1,18 +1,196 @@
 """
 Voxel Grid class, used to store the grid color information.
 """
-import json
+import itertools
+import zipfile
 import numpy as np
+from . import occupancy, vox_io
+
+# largest number of axes a neighbour is offset along, for each hollowing connectivity
+NEIGHBOUR_DISTANCE = {6: 1, 18: 2, 26: 3}
+
+# edge length of the chunks of a chunked grid
+CHUNK_SIZE = 32
+
+# largest grid edge that is still generated as a dense grid
+DENSE_LIMIT = 256
+
+# memory-mapped grid files start with this header, followed by the palette and the indices
+MAPPED_MAGIC = b'VOXGRID1'
+MAPPED_HEADER = np.dtype([('magic', 'S8'),
+                          ('width', '<u4'),
+                          ('height', '<u4'),
+                          ('depth', '<u4'),
+                          ('channels', '<u4'),
+                          ('palette_capacity', '<u4'),
+                          ('palette_size', '<u4'),
+                          ('index_dtype', 'S8'),
+                          ('data_offset', '<u8')])
+
+def index_dtype(palette_size):
+    """Smallest unsigned integer type that can index a palette of the given size.
+    """
+    if palette_size <= 1 << 8:
+        return np.uint8
+    if palette_size <= 1 << 16:
+        return np.uint16
+    return np.uint32
+
+def encode_colors(colors):
+    """Split an array of colors into a palette and a volume of palette indices. Index 0 is 
+    always the empty (all zero) color.
+
+    Args:
+        colors: Array of colors, with the color channels last
+
+    Returns:
+        Palette as a 2D float array, and the array of palette indices.
+    """
+    colors = np.asarray(colors, dtype=float)
+    channels = colors.shape[-1]
+    flat = colors.reshape(-1, channels)
+
+    # only the filled voxels need sorting, the empty ones all map to index 0
+    filled = flat.any(axis=1)
+    rows = np.ascontiguousarray(flat[filled])
+    keys = rows.view(np.dtype((np.void, rows.itemsize * channels))).reshape(-1)
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+
+    palette = np.zeros((len(unique_keys) + 1, channels), dtype=float)
+    palette[1:] = unique_keys.view(float).reshape(-1, channels)
+
+    indices = np.zeros(len(flat), dtype=index_dtype(len(palette)))
+    indices[filled] = inverse.reshape(-1) + 1
+
+    return palette, indices.reshape(colors.shape[:-1])
+
+def grid_regions(shape, chunk_size=CHUNK_SIZE):
+    """
+    Key and slices of every cubic block of a grid, in x, y, z order. Blocks on the far 
+    faces may be smaller.
+    """
+    counts = [-(-size // chunk_size) for size in shape]
+    for key in itertools.product(*map(range, counts)):
+        yield key, tuple(slice(k * chunk_size, min((k + 1) * chunk_size, size))
+                         for k, size in zip(key, shape))
+
+def color_keys(colors):
+    """
+    One byte key per row of colors, equal keys for equal colors.
+    """
+    rows = np.ascontiguousarray(colors, dtype=float)
+    return rows.view(np.dtype((np.void, rows.itemsize * rows.shape[1]))).reshape(-1)
+
+class PaletteLookup:
+    """
+    Keys of the palette colors in sorted order, to find the palette index of many colors 
+    at once with a binary search. Colors that appear twice in the palette resolve to their 
+    first index.
+    """
+    def __init__(self, palette):
+        keys = color_keys(palette)
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def find(self, colors):
+        """
+        Palette index of each color, -1 for colors that are not in the palette.
+        """
+        keys = color_keys(colors)
+        if len(self.keys) == 0:
+            return -np.ones(len(keys), dtype=np.int64)
+
+        found = np.searchsorted(self.keys, keys).clip(max=len(self.keys) - 1)
+        return np.where(self.keys[found] == keys, self.order[found], -1)
+
+    def add(self, colors, start):
+        """
+        Add colors that are not in the palette yet, at palette indices start, start + 1, ...
+        """
+        keys = color_keys(colors)
+        order = np.argsort(keys)
+        positions = np.searchsorted(self.keys, keys[order])
+
+        self.keys = np.insert(self.keys, positions, keys[order])
+        self.order = np.insert(self.order, positions, start + order)
+
+def map_to_palette(palette, lookup, colors, grow=True):
+    """Find the palette index of each color, appending the colors that are not in the 
+    palette yet. The lookup is updated along with the palette.
+
+    Args:
+        palette: Array of palette colors
+        lookup (PaletteLookup): Lookup of the palette
+        colors: Array of colors, one row each
+        grow (bool, optional): Append missing colors, instead of raising a ValueError. 
+        Defaults to True.
+
+    Returns:
+        The palette, extended by any new colors, and the array of palette indices.
+    """
+    unique, indices = encode_colors(np.asarray(colors, dtype=float).reshape(-1, palette.shape[1]))
+    remap = lookup.find(unique)
+
+    missing = np.flatnonzero(remap < 0)
+    if len(missing):
+        if not grow:
+            raise ValueError(f"Color {unique[missing[0]]} is not in the grid palette")
+
+        remap[missing] = len(palette) + np.arange(len(missing))
+        lookup.add(unique[missing], len(palette))
+        palette = np.vstack([palette, unique[missing]])
+
+    return palette, remap[indices]
 
 class VoxelGrid:
     """
-    Voxel Grid class.
+    Voxel Grid class. Colors are stored as a volume of indices into a palette of colors, 
+    and expanded to a float array on demand.
     """
     def __init__(self, width, height, depth, channels=4):
         self.width = width
         self.height = height
         self.depth = depth
-        self.colors = np.zeros(shape=(width, height, depth, channels), dtype=float)
+        self.palette = np.zeros(shape=(1, channels), dtype=float)
+        self.indices = np.zeros(shape=(width, height, depth), dtype=np.uint8)
+
+    @property
+    def palette(self):
+        """
+        Colors of the palette, index 0 is the empty color.
+        """
+        return self._palette
+
+    @palette.setter
+    def palette(self, palette):
+        self._palette = palette
+        self._lookup = None
+
+    def palette_lookup(self):
+        """
+        Lookup of the palette colors, kept until the palette is replaced.
+        """
+        if self._lookup is None or len(self._lookup) != len(self.palette):
+            self._lookup = PaletteLookup(self.palette)
+
+        return self._lookup
+
+    @property
+    def colors(self):
+        """
+        Float array of colors, expanded from the palette on every access. The array is 
+        read-only, the grid is changed through set_color and set_voxels.
+        """
+        colors = self.palette[self.indices]
+        colors.flags.writeable = False
+        return colors
+
+    @colors.setter
+    def colors(self, colors):
+        self.palette, self.indices = encode_colors(colors)
 
     def get_colors(self):
         """
@@ -20,73 +198,821 @@ class VoxelGrid:
         """
         return self.colors
 
+    def palette_indices(self, colors):
+        """Look up the palette index of each color, adding the colors that are not in the 
+        palette yet.
+
+        Args:
+            colors: Array of colors, one row each
+
+        Returns:
+            Array of palette indices.
+        """
+        lookup = self.palette_lookup()
+        palette, indices = map_to_palette(np.asarray(self.palette), lookup, colors)
+
+        if len(palette) != len(self.palette):
+            self.palette = palette
+            self._lookup = lookup
+            if len(self.palette) - 1 > np.iinfo(self.indices.dtype).max:
+                self.indices = self.indices.astype(index_dtype(len(self.palette)))
+
+        return indices
+
+    def set_voxels(self, xs, ys, zs, colors):
+        """Write the colors of a set of voxels, adding new colors to the palette.
+
+        Args:
+            xs, ys, zs: Voxel coordinates
+            colors: Colors of the voxels, one row each
+        """
+        self.indices[xs, ys, zs] = self.palette_indices(colors)
+
     def set_color(self, x, y, z, color):
         """
         Set color at (x,y,z) as specified
         """
-        self.colors[x, y, z] = color
+        self.indices[x, y, z] = self.palette_indices(color)[0]
 
     # slice by slice
     def visualize_grid(self):
         """
         Print layers of the grid.
         """
+        colors = self.colors
+
         for z in range(self.depth):
             print(f"Layer {z + 1}:")
             for y in range(self.height):
                 for x in range(self.width):
-                    color = self.colors[x, y, z]
+                    color = colors[x, y, z]
                     print(f"Voxel ({x}, {y}, {z}): {color}")
             print("\n") 
 
-    def write_grid(self):
+    def write_grid(self, path="./out.npz", compress=True):
+        """Write the grid to a binary .npz file, see save_grid.
+
+        Args:
+            path (string, optional): Path to the file. Defaults to "./out.npz".
+            compress (bool, optional): Deflate the arrays. Defaults to True.
+        """
+        save_grid(self, path, compress)
+
+    def to_sparse(self):
+        """
+        Convert into a sparse grid holding only the filled voxels.
+        """
+        return SparseVoxelGrid.from_grid(self)
+
+    def hollow_out_grid(self, colors, connectivity=26):
         """
-        Write grid values to a JSON file.
+        Produce a hollow version of the grid to improve performance.
         """
-        voxel_data = []
-        w, h, d, _ = self.colors.shape
+        return hollow_out_grid(colors, connectivity)
 
-        for x in range(w):
-            for y in range(h):
-                for z in range(d):
-                    color = self.colors[x, y, z]
-                    voxel_data.append({
-                        "pos": [x, y, z],
-                        "color": color.tolist()
-                    })
+    def hollow_out(self, connectivity=26):
+        """Produce a hollow version of the grid, working on the palette indices directly. 
+        Colors that only hidden voxels used are dropped from the palette.
 
-        with open("./out.json", "w") as f:
-            json.dump(voxel_data, f)
+        Args:
+            connectivity (int, optional): Neighbours that need to be filled, 6, 18 or 26. 
+            Defaults to 26.
 
-    def hollow_out_grid(self, colors):
+        Returns:
+            Hollowed dense grid.
         """
-        Produce a hollow version of the grid to improve performance.
+        filled = np.asarray(self.palette)[:, 3] != 0
+        indices = np.array(self.indices)
+        indices[surrounded_voxels(filled[indices], connectivity)] = 0
+
+        # keep the empty color at index 0 and the remaining colors in their order
+        used = np.bincount(indices.ravel(), minlength=len(self.palette)) > 0
+        used[0] = True
+        remap = np.cumsum(used) - 1
+
+        hollow = VoxelGrid(self.width, self.height, self.depth, channels=self.palette.shape[1])
+        hollow.palette = np.array(self.palette)[used]
+        hollow.indices = remap.astype(index_dtype(int(used.sum())))[indices]
+
+        return hollow
+
+def hollow_out_grid(colors, connectivity=26):
+    """Produce a hollow version of a grid, by clearing every voxel that is fully surrounded 
+    by non-transparent neighbours. Voxels on the grid boundary are always kept.
+
+    Args:
+        colors: 3D array of colors, or a sparse or chunked grid
+        connectivity (int, optional): Neighbours that need to be filled, 6 (faces), 
+        18 (faces and edges) or 26 (faces, edges and corners). Defaults to 26.
+
+    Returns:
+        Copy of the colors with the hidden voxels cleared.
+    """
+    if connectivity not in NEIGHBOUR_DISTANCE:
+        raise ValueError(f"Unsupported connectivity {connectivity}, use 6, 18 or 26")
+
+    if isinstance(colors, (VoxelGrid, SparseVoxelGrid, ChunkedVoxelGrid)):
+        return colors.hollow_out(connectivity)
+
+    hollow_grid = np.copy(colors)
+    hollow_grid[surrounded_voxels(colors[..., 3] != 0, connectivity)] = 0
+
+    return hollow_grid
+
+def surrounded_voxels(occupied, connectivity=26):
+    """Find the voxels whose neighbours are all filled. Neighbours outside the grid count 
+    as empty, so voxels on the grid boundary are never surrounded.
+
+    Args:
+        occupied: 3D boolean mask of the filled voxels
+        connectivity (int, optional): Neighbours that need to be filled, 6, 18 or 26. 
+        Defaults to 26.
+
+    Returns:
+        3D boolean mask of the surrounded voxels.
+    """
+    if connectivity not in NEIGHBOUR_DISTANCE:
+        raise ValueError(f"Unsupported connectivity {connectivity}, use 6, 18 or 26")
+
+    # work on bit-packed occupancy
+    depth = occupied.shape[2]
+    occupied = occupancy.pack(occupied)
+
+    if connectivity == 26:
+        # the 3x3x3 neighbourhood is separable, erode one axis at a time
+        surrounded = occupied
+        for axis in range(3):
+            surrounded = (surrounded & occupancy.shift(surrounded, axis, 1, depth)
+                          & occupancy.shift(surrounded, axis, -1, depth))
+    else:
+        surrounded = occupied.copy()
+        for offset in neighbour_offsets(connectivity):
+            neighbour = occupied
+            for axis, step in enumerate(offset):
+                if step:
+                    neighbour = occupancy.shift(neighbour, axis, step, depth)
+            surrounded &= neighbour
+
+    return occupancy.unpack(surrounded, depth)
+
+def neighbour_offsets(connectivity):
+    """Offsets of the neighbours that need to be filled for a voxel to count as surrounded.
+    """
+    return [offset for offset in itertools.product((-1, 0, 1), repeat=3)
+            if 0 < sum(map(abs, offset)) <= NEIGHBOUR_DISTANCE[connectivity]]
+
+class SparseVoxelGrid:
+    """
+    Sparse Voxel Grid class, for mostly empty volumes. Only the filled voxels are stored, 
+    as their sorted flat positions in the grid and their indices into a palette of colors.
+    """
+    def __init__(self, width, height, depth, keys=None, indices=None, palette=None, channels=4):
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.keys = np.zeros(0, dtype=np.int64) if keys is None else np.asarray(keys, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.uint8) if indices is None else np.asarray(indices)
+        self.palette = np.zeros((1, channels), dtype=float) if palette is None else palette
+
+    @property
+    def shape(self):
+        """
+        Shape of the dense grid.
+        """
+        return (self.width, self.height, self.depth)
+
+    @classmethod
+    def from_colors(cls, colors):
+        """Build a sparse grid from a dense array of colors.
+
+        Args:
+            colors: 3D array of colors
+
+        Returns:
+            Sparse grid holding the filled voxels.
+        """
+        palette, indices = encode_colors(colors)
+        flat = indices.reshape(-1)
+        keys = np.flatnonzero(flat)
+
+        return cls(*indices.shape, keys, flat[keys], palette)
+
+    @classmethod
+    def from_grid(cls, grid):
+        """Build a sparse grid from a dense voxel grid, sharing its palette.
+
+        Args:
+            grid (VoxelGrid): Dense grid
+
+        Returns:
+            Sparse grid holding the filled voxels.
+        """
+        flat = grid.indices.reshape(-1)
+        keys = np.flatnonzero(flat)
+
+        return cls(*grid.indices.shape, keys, flat[keys], grid.palette.copy())
+
+    def to_grid(self):
+        """
+        Expand into a dense voxel grid.
+        """
+        grid = VoxelGrid(*self.shape, channels=self.palette.shape[1])
+        grid.palette = self.palette.copy()
+
+        indices = np.zeros(self.width * self.height * self.depth, dtype=index_dtype(len(self.palette)))
+        indices[self.keys] = self.indices
+        grid.indices = indices.reshape(self.shape)
+
+        return grid
+
+    @property
+    def colors(self):
+        """
+        Dense float array of colors, expanded on every access.
+        """
+        return self.to_grid().colors
+
+    def get_colors(self):
+        """
+        Returns 3D array of colors
+        """
+        return self.colors
+
+    def coords(self):
         """
-        width, height, depth, _ = colors.shape
-        hollow_grid = np.copy(colors)
-
-        for x in range(1, width - 1):
-            for y in range(1, height - 1):
-                for z in range(1, depth - 1):
-                    if colors[x, y, z][3] == 0:
-                        continue
-
-                    fully_surrounded = True
-                    for dx in (-1, 0, 1):
-                        for dy in (-1, 0, 1):
-                            for dz in (-1, 0, 1):
-                                if dx == dy == dz == 0:
-                                    continue 
-                                neighbor = colors[x + dx, y + dy, z + dz]
-                                if neighbor[3] == 0:
-                                    fully_surrounded = False
-                                    break
-                            if not fully_surrounded:
-                                break
-                        if not fully_surrounded:
-                            break
-
-                    if fully_surrounded:
-                        hollow_grid[x, y, z] = [0, 0, 0, 0]
-
-        return hollow_grid
+        Coordinates of the stored voxels, as x, y and z arrays.
+        """
+        return np.unravel_index(self.keys, self.shape)
+
+    def voxel_colors(self):
+        """
+        Colors of the stored voxels, one row each.
+        """
+        return self.palette[self.indices]
+
+    def occupied(self):
+        """
+        Mask of the stored voxels that are not transparent.
+        """
+        return self.palette[self.indices, 3] != 0
+
+    def hollow_out(self, connectivity=26):
+        """Produce a hollow version of the grid, the sparse counterpart of hollow_out_grid.
+        Neighbours are looked up in the sorted keys, so the cost scales with the filled voxels.
+
+        Args:
+            connectivity (int, optional): Neighbours that need to be filled, 6, 18 or 26. 
+            Defaults to 26.
+
+        Returns:
+            Sparse grid without the hidden voxels.
+        """
+        if connectivity not in NEIGHBOUR_DISTANCE:
+            raise ValueError(f"Unsupported connectivity {connectivity}, use 6, 18 or 26")
+
+        occupied = np.flatnonzero(self.occupied())
+        occupied_keys = self.keys[occupied]
+        x, y, z = np.unravel_index(occupied_keys, self.shape)
+
+        # boundary voxels are always kept, so interior neighbours never leave the grid
+        surrounded = ((x > 0) & (x < self.width - 1) & (y > 0) & (y < self.height - 1)
+                      & (z > 0) & (z < self.depth - 1))
+
+        for dx, dy, dz in neighbour_offsets(connectivity):
+            if not surrounded.any():
+                break
+            neighbours = occupied_keys + (dx * self.height + dy) * self.depth + dz
+            found = np.searchsorted(occupied_keys, neighbours).clip(max=len(occupied_keys) - 1)
+            surrounded &= occupied_keys[found] == neighbours
+
+        keep = np.ones(len(self.keys), dtype=bool)
+        keep[occupied[surrounded]] = False
+
+        return SparseVoxelGrid(*self.shape, self.keys[keep], self.indices[keep], self.palette)
+
+class ChunkedVoxelGrid:
+    """
+    Chunked Voxel Grid class, for volumes too large to store densely. The grid is split 
+    into cubic chunks of palette indices that share one palette. Chunks are allocated on 
+    the first write and empty chunks are not stored at all.
+    """
+    def __init__(self, width, height, depth, chunk_size=CHUNK_SIZE, channels=4):
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.chunk_size = chunk_size
+        self.palette = np.zeros((1, channels), dtype=float)
+        self.chunks = {}
+
+    @property
+    def palette(self):
+        """
+        Colors of the palette shared by all chunks, index 0 is the empty color.
+        """
+        return self._palette
+
+    @palette.setter
+    def palette(self, palette):
+        self._palette = palette
+        self._lookup = None
+
+    def palette_lookup(self):
+        """
+        Lookup of the palette colors, kept until the palette is replaced.
+        """
+        if self._lookup is None or len(self._lookup) != len(self.palette):
+            self._lookup = PaletteLookup(self.palette)
+
+        return self._lookup
+
+    @property
+    def shape(self):
+        """
+        Shape of the dense grid.
+        """
+        return (self.width, self.height, self.depth)
+
+    def chunk_region(self, key):
+        """
+        Slices of the grid covered by a chunk. Chunks on the far faces may be smaller.
+        """
+        return tuple(slice(k * self.chunk_size, min((k + 1) * self.chunk_size, size))
+                     for k, size in zip(key, self.shape))
+
+    def regions(self):
+        """
+        Key and slices of every chunk of the grid, allocated or not, in x, y, z order.
+        """
+        return grid_regions(self.shape, self.chunk_size)
+
+    @classmethod
+    def from_colors(cls, colors, chunk_size=CHUNK_SIZE):
+        """Build a chunked grid from a dense array of colors.
+
+        Args:
+            colors: 3D array of colors
+            chunk_size (int, optional): Edge length of the chunks. Defaults to CHUNK_SIZE.
+
+        Returns:
+            Chunked grid holding the non-empty chunks.
+        """
+        grid = cls(*colors.shape[:3], chunk_size=chunk_size, channels=colors.shape[3])
+        for key, region in grid.regions():
+            grid.set_chunk(key, colors[region])
+
+        return grid
+
+    def get_chunk(self, key):
+        """
+        Float array of the colors of a chunk, all zero if it is not allocated.
+        """
+        if key in self.chunks:
+            return self.palette[self.chunks[key]]
+
+        shape = tuple(s.stop - s.start for s in self.chunk_region(key))
+        return np.zeros(shape + self.palette.shape[1:], dtype=float)
+
+    def set_chunk(self, key, colors):
+        """Overwrite the colors of a chunk, adding new colors to the shared palette. 
+        The chunk is dropped if it ends up empty.
+
+        Args:
+            key: Chunk key, as returned by regions()
+            colors: Array of colors with the shape of the chunk
+        """
+        lookup = self.palette_lookup()
+        palette, indices = map_to_palette(self.palette, lookup, colors)
+        if not indices.any():
+            self.chunks.pop(key, None)
+            return
+
+        if len(palette) != len(self.palette):
+            self.palette = palette
+            self._lookup = lookup
+
+        self.chunks[key] = indices.reshape(colors.shape[:-1]).astype(index_dtype(len(self.palette)))
+
+    def set_voxels(self, xs, ys, zs, colors):
+        """Write the colors of a set of voxels, one chunk at a time. The colors are mapped 
+        onto the palette once, and their indices written straight into the chunks.
+
+        Args:
+            xs, ys, zs: Voxel coordinates
+            colors: Colors of the voxels, one row each
+        """
+        xs, ys, zs = (np.asarray(c, dtype=np.int64).reshape(-1) for c in (xs, ys, zs))
+        if len(xs) == 0:
+            return
+
+        lookup = self.palette_lookup()
+        palette, indices = map_to_palette(self.palette, lookup, colors)
+        if len(palette) != len(self.palette):
+            self.palette = palette
+            self._lookup = lookup
+        dtype = index_dtype(len(self.palette))
+
+        # sort the voxels by chunk once, a stable sort keeps the last write to a voxel last
+        counts = [-(-size // self.chunk_size) for size in self.shape]
+        chunk_keys = np.ravel_multi_index((xs // self.chunk_size, ys // self.chunk_size, zs // self.chunk_size), counts)
+        order = np.argsort(chunk_keys, kind='stable')
+        chunk_keys = chunk_keys[order]
+        starts = np.flatnonzero(np.diff(chunk_keys, prepend=-1))
+
+        for start, stop in zip(starts, np.append(starts[1:], len(order))):
+            key = tuple(int(k) for k in np.unravel_index(chunk_keys[start], counts))
+            region = self.chunk_region(key)
+            written = order[start:stop]
+
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                chunk = np.zeros(tuple(s.stop - s.start for s in region), dtype=dtype)
+            elif chunk.dtype != dtype:
+                chunk = chunk.astype(dtype)
+
+            chunk[xs[written] - region[0].start, ys[written] - region[1].start, zs[written] - region[2].start] = indices[written]
+
+            # the chunk is dropped if the write left it empty
+            if chunk.any():
+                self.chunks[key] = chunk
+            else:
+                self.chunks.pop(key, None)
+
+    def set_color(self, x, y, z, color):
+        """
+        Set color at (x,y,z) as specified
+        """
+        self.set_voxels(np.array([x]), np.array([y]), np.array([z]), np.asarray(color, dtype=float)[None])
+
+    def get_block(self, region):
+        """Float array of the colors in a block of the grid, gathered from the chunks it overlaps.
+
+        Args:
+            region: Tuple of x, y and z slices
+
+        Returns:
+            Array of colors with the shape of the block.
+        """
+        block = np.zeros(tuple(s.stop - s.start for s in region) + self.palette.shape[1:], dtype=float)
+        spans = [range(s.start // self.chunk_size, -(-s.stop // self.chunk_size)) for s in region]
+
+        for key in itertools.product(*spans):
+            if key not in self.chunks:
+                continue
+            chunk_region = self.chunk_region(key)
+            overlap = [slice(max(a.start, b.start), min(a.stop, b.stop)) for a, b in zip(region, chunk_region)]
+            source = tuple(slice(o.start - c.start, o.stop - c.start) for o, c in zip(overlap, chunk_region))
+            target = tuple(slice(o.start - r.start, o.stop - r.start) for o, r in zip(overlap, region))
+            block[target] = self.palette[self.chunks[key][source]]
+
+        return block
+
+    def hollow_out(self, connectivity=26):
+        """Produce a hollow version of the grid, one chunk at a time. Each chunk is hollowed 
+        together with a one voxel border of its neighbours, which gives the same result as 
+        hollowing the whole grid.
+
+        Args:
+            connectivity (int, optional): Neighbours that need to be filled, 6, 18 or 26. 
+            Defaults to 26.
+
+        Returns:
+            Hollowed chunked grid.
+        """
+        hollow = ChunkedVoxelGrid(*self.shape, chunk_size=self.chunk_size, channels=self.palette.shape[1])
+
+        for key in sorted(self.chunks):
+            region = self.chunk_region(key)
+            padded = tuple(slice(max(s.start - 1, 0), min(s.stop + 1, size)) for s, size in zip(region, self.shape))
+            block = hollow_out_grid(self.get_block(padded), connectivity)
+            inner = tuple(slice(s.start - p.start, s.stop - p.start) for s, p in zip(region, padded))
+            hollow.set_chunk(key, block[inner])
+
+        return hollow
+
+    def to_grid(self):
+        """
+        Expand into a dense voxel grid.
+        """
+        grid = VoxelGrid(*self.shape, channels=self.palette.shape[1])
+        grid.palette = self.palette.copy()
+        grid.indices = np.zeros(self.shape, dtype=index_dtype(len(self.palette)))
+
+        for key, indices in self.chunks.items():
+            grid.indices[self.chunk_region(key)] = indices
+
+        return grid
+
+    def chunk_voxels(self, key):
+        """
+        Flat positions in the grid and palette indices of the filled voxels of a chunk.
+        """
+        chunk = self.chunks[key]
+        local = np.nonzero(chunk)
+        coords = [c + s.start for c, s in zip(local, self.chunk_region(key))]
+
+        return np.ravel_multi_index(coords, self.shape), chunk[local]
+
+    def to_sparse(self):
+        """
+        Convert into a sparse grid holding only the filled voxels.
+        """
+        keys = [np.zeros(0, dtype=np.int64)]
+        indices = [np.zeros(0, dtype=np.uint32)]
+
+        for key in self.chunks:
+            chunk_keys, chunk_indices = self.chunk_voxels(key)
+            keys.append(chunk_keys)
+            indices.append(chunk_indices)
+
+        keys = np.concatenate(keys)
+        order = np.argsort(keys)
+        indices = np.concatenate(indices)[order].astype(index_dtype(len(self.palette)))
+
+        return SparseVoxelGrid(*self.shape, keys[order], indices, self.palette.copy())
+
+    @property
+    def colors(self):
+        """
+        Dense float array of colors, expanded on every access.
+        """
+        return self.to_grid().colors
+
+    def get_colors(self):
+        """
+        Returns 3D array of colors
+        """
+        return self.colors
+
+class MappedVoxelGrid(VoxelGrid):
+    """
+    Voxel Grid stored in a file instead of memory. The palette and the indices are 
+    memory-mapped, so a grid can be reopened without parsing and processes can write 
+    disjoint slabs of the same grid in parallel. The palette has a fixed capacity, 
+    chosen when the file is created.
+    """
+    def __init__(self, path, mode='r+'):
+        header = np.memmap(path, dtype=MAPPED_HEADER, mode=mode, shape=(1,))
+        if header['magic'][0] != MAPPED_MAGIC:
+            raise ValueError(f"{path} is not a voxel grid file")
+
+        self.path = path
+        self._header = header
+        self._lookup = None
+        self.width, self.height, self.depth = (int(header[axis][0]) for axis in ('width', 'height', 'depth'))
+
+        capacity = int(header['palette_capacity'][0])
+        channels = int(header['channels'][0])
+        self._palette = np.memmap(path, dtype='<f8', mode=mode, offset=MAPPED_HEADER.itemsize,
+                                  shape=(capacity, channels))
+        self.indices = np.memmap(path, dtype=np.dtype(header['index_dtype'][0].decode()), mode=mode,
+                                 offset=int(header['data_offset'][0]),
+                                 shape=(self.width, self.height, self.depth))
+
+    @classmethod
+    def create(cls, path, width, height, depth, palette_capacity=256, channels=4):
+        """Create an empty grid file and open it for writing.
+
+        Args:
+            path (string): Path to the grid file
+            width (int): Grid width
+            height (int): Grid height
+            depth (int): Grid depth
+            palette_capacity (int, optional): Largest number of colors the grid can hold, 
+            including the empty color. Defaults to 256.
+            channels (int, optional): Color channels. Defaults to 4.
+
+        Returns:
+            Opened grid.
+        """
+        dtype = np.dtype(index_dtype(palette_capacity))
+        data_offset = MAPPED_HEADER.itemsize + palette_capacity * channels * 8
+
+        with open(path, 'wb') as f:
+            f.truncate(data_offset + width * height * depth * dtype.itemsize)
+
+        header = np.memmap(path, dtype=MAPPED_HEADER, mode='r+', shape=(1,))
+        header[0] = (MAPPED_MAGIC, width, height, depth, channels, palette_capacity, 1,
+                     dtype.str.encode(), data_offset)
+        header.flush()
+
+        return cls(path)
+
+    @classmethod
+    def from_grid(cls, path, grid, palette_capacity=None):
+        """Write a dense or chunked grid to a grid file, chunk by chunk for chunked grids.
+
+        Args:
+            path (string): Path to the grid file
+            grid: Grid to store
+            palette_capacity (int, optional): Palette capacity of the file. Defaults to None, 
+            which fits the palette of the grid exactly.
+
+        Returns:
+            Opened grid.
+        """
+        shape = grid.shape if isinstance(grid, ChunkedVoxelGrid) else grid.indices.shape
+        capacity = max(palette_capacity or 0, len(grid.palette))
+
+        mapped = cls.create(path, *shape, palette_capacity=capacity, channels=grid.palette.shape[1])
+        mapped.palette = grid.palette
+
+        if isinstance(grid, ChunkedVoxelGrid):
+            for key, chunk in grid.chunks.items():
+                mapped.indices[grid.chunk_region(key)] = chunk
+        else:
+            mapped.indices[...] = grid.indices
+
+        mapped.flush()
+        return mapped
+
+    @property
+    def palette(self):
+        """
+        Colors of the palette that are in use, as a view of the file.
+        """
+        return self._palette[:int(self._header['palette_size'][0])]
+
+    @palette.setter
+    def palette(self, palette):
+        if len(palette) > len(self._palette):
+            raise ValueError(f"Palette of {len(palette)} colors does not fit the capacity "
+                             f"of {len(self._palette)}")
+
+        self._palette[:len(palette)] = palette
+        self._header['palette_size'] = len(palette)
+        self._lookup = None
+
+    @property
+    def colors(self):
+        """
+        Float array of colors, expanded from the palette on every access. The array is 
+        read-only, like the colors of a dense grid.
+        """
+        colors = self.palette[self.indices]
+        colors.flags.writeable = False
+        return colors
+
+    @colors.setter
+    def colors(self, colors):
+        palette, indices = encode_colors(colors)
+        self.palette = palette
+        self.indices[...] = indices
+
+    def write_slab(self, start, colors):
+        """Write a slab of colors along the x axis. Every color has to be in the palette 
+        already, so that writers never need to grow the palette at the same time.
+
+        Args:
+            start (int): First x position of the slab
+            colors: Array of colors, with the height and depth of the grid
+        """
+        colors = np.asarray(colors, dtype=float)
+        _, indices = map_to_palette(np.asarray(self.palette), self.palette_lookup(), colors, grow=False)
+
+        self.indices[start:start + len(colors)] = indices.reshape(colors.shape[:-1])
+
+    def flush(self):
+        """
+        Write all changes to the file.
+        """
+        self._header.flush()
+        self._palette.flush()
+        self.indices.flush()
+
+class GridWriter:
+    """
+    Streams a grid into a binary .npz file. The filled voxels are written in blocks of flat 
+    grid positions and palette indices, each block as soon as it is passed in, and the 
+    palette is written when the writer is closed.
+    """
+    def __init__(self, path, width, height, depth, compress=True):
+        self.shape = (width, height, depth)
+        self.blocks = 0
+        self._zip = zipfile.ZipFile(path, 'w',
+                                    zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED,
+                                    allowZip64=True)
+
+    def _write_array(self, name, array):
+        with self._zip.open(name + '.npy', 'w', force_zip64=True) as f:
+            np.lib.format.write_array(f, np.asarray(array), allow_pickle=False)
+
+    def write(self, keys, indices):
+        """Write a block of filled voxels.
+
+        Args:
+            keys: Flat positions of the voxels in the grid
+            indices: Palette indices of the voxels
+        """
+        self._write_array(f'keys_{self.blocks}', np.asarray(keys, dtype=np.int64))
+        self._write_array(f'indices_{self.blocks}', indices)
+        self.blocks += 1
+
+    def close(self, palette):
+        """Write the header arrays and close the file.
+
+        Args:
+            palette: Palette the written indices refer to
+        """
+        self._write_array('shape', np.array(self.shape, dtype=np.int64))
+        self._write_array('palette', np.asarray(palette, dtype=float))
+        self._write_array('blocks', np.array(self.blocks, dtype=np.int64))
+        self._zip.close()
+
+def save_grid(grid, path, compress=True):
+    """Write a grid to a binary .npz file holding its shape, palette and filled voxels. 
+    Chunked grids are streamed one chunk at a time.
+
+    Args:
+        grid: Dense, sparse, chunked or memory-mapped grid
+        path (string): Path to the file
+        compress (bool, optional): Deflate the arrays. Defaults to True.
+    """
+    if isinstance(grid, (SparseVoxelGrid, ChunkedVoxelGrid)):
+        shape = grid.shape
+    else:
+        shape = grid.indices.shape
+
+    writer = GridWriter(path, *shape, compress=compress)
+    try:
+        if isinstance(grid, ChunkedVoxelGrid):
+            for key in sorted(grid.chunks):
+                writer.write(*grid.chunk_voxels(key))
+
+        elif isinstance(grid, SparseVoxelGrid):
+            writer.write(grid.keys, grid.indices)
+
+        else:
+            flat = grid.indices.reshape(-1)
+            keys = np.flatnonzero(flat)
+            writer.write(keys, flat[keys])
+
+    finally:
+        writer.close(grid.palette)
+
+def load_grid(path, sparse=False):
+    """Read a grid written by save_grid.
+
+    Args:
+        path (string): Path to the file
+        sparse (bool, optional): Return a sparse grid instead of a dense one. Defaults to False.
+
+    Returns:
+        Loaded grid.
+    """
+    with np.load(path) as data:
+        shape = tuple(int(size) for size in data['shape'])
+        palette = data['palette']
+        blocks = range(int(data['blocks']))
+        keys = np.concatenate([np.zeros(0, dtype=np.int64)] + [data[f'keys_{i}'] for i in blocks])
+        indices = np.concatenate([np.zeros(0, dtype=np.uint8)] + [data[f'indices_{i}'] for i in blocks])
+
+    indices = indices.astype(index_dtype(len(palette)))
+
+    if sparse:
+        order = np.argsort(keys)
+        return SparseVoxelGrid(*shape, keys[order], indices[order], palette)
+
+    grid = VoxelGrid(*shape, channels=palette.shape[1])
+    grid.palette = palette
+    grid.indices = np.zeros(shape, dtype=indices.dtype)
+    grid.indices.reshape(-1)[keys] = indices
+
+    return grid
+
+def load_vox(path):
+    """Read the first model of a MagicaVoxel .vox file into a grid.
+
+    The voxels keep the axis order of the file, without any swap or flip. MagicaVoxel is
+    z-up like the grid, so z stays the height axis, but its models face the opposite
+    way along x and y. generate_comparison_grid.rotate_voxel_grid_for_blender turns them
+    around, and is only applied when grids are compared, not here.
+
+    Args:
+        path (string): Path to the .vox file
+
+    Returns:
+        Loaded grid, using the file palette as is.
+    """
+    palette, indices = vox_io.read_vox(path)
+
+    grid = VoxelGrid(*indices.shape)
+    grid.palette = palette.astype(float)
+    grid.indices = indices
+
+    return grid
+
+def save_vox(grid, path):
+    """Write a grid to a MagicaVoxel .vox file, see vox_io.write_vox.
+
+    The grid (x, y, z) axes are written as the file x, y and z axes as they are, so z stays
+    up and a grid written here loads back unchanged through load_vox. No rotation to or
+    from the Blender orientation is applied, see load_vox.
+
+    Args:
+        grid: Dense, sparse, chunked or memory-mapped grid
+        path (string): Path to the .vox file
+    """
+    if isinstance(grid, (SparseVoxelGrid, ChunkedVoxelGrid)):
+        grid = grid.to_grid()
+
+    vox_io.write_vox(path, grid.palette, grid.indices)
@@ -1,8 +1,29 @@
 """
 This module implements spatial carving using photometric consistency. 
 """
+from functools import lru_cache
+import math
 import numpy as np
-from . import VoxelGrid
+from . import color_merge, occupancy, projection
+
+@lru_cache(maxsize=64)
+def _concavity_axis_mask(size, concavity_depth):
+    """Positions along one grid axis that lie within the concavity zone of either side.
+    The full zone is the union of the masks of the three axes.
+
+    Args:
+        size (int): Size of the grid along the axis
+        concavity_depth (float): Concavity depth multiplier
+
+    Returns:
+        Read-only 1D boolean mask
+    """
+    i = np.arange(size)
+    mask = (((i < (size-1) / 2) & (i < (size-1) * concavity_depth)) |
+            ((i >= (size-1) / 2) & (i > (size-1) * (1 - concavity_depth))))
+    mask.flags.writeable = False
+
+    return mask
 
 def spatial_carve(images,
                     width,
@@ -12,7 +33,8 @@ def spatial_carve(images,
                     concavity_depth,
                     colors_threshold=6,
                     variance_threshold=0.5,
-                    hollow_grid=False):
+                    hollow_grid=False,
+                    chunk_size=None):
     """Apply spatial carving to generate the grid from the passed images.
 
     Args:
@@ -28,114 +50,68 @@ def spatial_carve(images,
         Defaults to 0.5.
         hollow_grid (bool, optional): Choice for whether the model should be filled in at 
         non-visible voxel points. Defaults to False.
+        chunk_size (int, optional): Process the grid in chunks of this size and return a 
+        chunked grid. Defaults to None, which fills a dense grid in one pass.
 
     Returns:
         The 3D grid of colors representing the model
     """
-    voxel_grid = VoxelGrid.VoxelGrid(width, height, depth)
-    colors = np.full((width, height, depth, 4), [0, 0, 0, 1], dtype=float)
-
-    for x in range (width):
-        for z in range (height):
-            for y in range (depth):
-                candidates = []
-                available_projections = {}
-
-                # front
-                if 'FRONT' in images:
-                    front_color = images['FRONT'][z, x]
-                    if front_color[3] > 0:
-                        candidates.append(front_color)
-                        available_projections['front'] = front_color
-
-                # back
-                if 'BACK' in images:
-                    back_color = images['BACK'][z, width - 1 - x]
-                    if back_color[3] > 0:
-                        candidates.append(back_color)
-                        available_projections['back'] = back_color
-
-                # left
-                if 'LEFT' in images:
-                    left_color = images['LEFT'][z, depth - 1 - y]
-                    if left_color[3] > 0:
-                        candidates.append(left_color)
-                        available_projections['left'] = left_color
-
-                # right
-                if 'RIGHT' in images:
-                    right_color = images['RIGHT'][z, y]
-                    if right_color[3] > 0:
-                        candidates.append(right_color)
-                        available_projections['right'] = right_color
-
-                # top
-                if 'TOP' in images:
-                    top_color = images['TOP'][y, x]
-                    if top_color[3] > 0:
-                        candidates.append(top_color)
-                        available_projections['top'] = top_color
-
-                # bottom
-                if 'BOTTOM' in images:
-                    bottom_color = images['BOTTOM'][depth - 1 - y, x]
-                    if bottom_color[3] > 0:
-                        candidates.append(bottom_color)
-                        available_projections['bottom'] = bottom_color
-
-                if len(candidates) < colors_threshold / 1.0:
-                    colors[x, y, z] = [0, 0, 0, 0]
-                    continue
-
-                colors_array = np.array([c[:3] for c in candidates])
-                variance = np.var(colors_array, axis=0)
-                total_variance = np.sum(variance)
-
-                in_concavity_zone = (
-                    (x < (width-1) / 2 and x < (width-1) * concavity_depth) or    # Left
-                    (x >= (width-1) / 2 and x > (width-1) * (1 - concavity_depth)) or  # Right
-                    (y < (depth-1) / 2 and y < (depth-1) * concavity_depth) or    # Front
-                    (y >= (depth-1) / 2 and y > (depth-1) * (1 - concavity_depth)) or  # Back
-                    (z < (height-1) / 2 and z < (height-1) * concavity_depth) or  # Bottom
-                    (z >= (height-1) / 2 and z > (height-1) * (1 - concavity_depth))   # Top
-                )
-
-                if total_variance > variance_threshold and in_concavity_zone:
-                    colors[x, y, z] = [0, 0, 0, 0]
-                    continue
-
-                else:
-                    # finally, assign color based on merge technique
-                    final_color = []
-
-                    if merge_technique == "MAJORITY_VOTE":
-                        colors_np = np.array([c[:3] for c in candidates])
-                        unique_colors, counts = np.unique(colors_np, axis=0, return_counts=True)
-                        max_index = np.argmax(counts)
-                        final_color = list(unique_colors[max_index]) + [1.0] 
-
-                    else:
-                        distances = {
-                            'front': y,
-                            'back': depth - 1 - y,
-                            'left': x,
-                            'right': width - 1 - x,
-                            'top': height - 1 - z,
-                            'bottom': z
-                        }
-                        closest_projection = min(
-                            available_projections.keys(),
-                            key=lambda k: distances[k]
-                        )
-                        final_color = available_projections[closest_projection]
-
-                    colors[x, y, z] = final_color
-
-    if hollow_grid:
-        hollow_grid = voxel_grid.hollow_out_grid(colors)
-        voxel_grid.colors = hollow_grid
-
-    else:
-        voxel_grid.colors = colors
-
-    return voxel_grid
+    views = [view for view in projection.VIEWS if view in images]
+
+    if merge_technique == "MAJORITY_VOTE":
+        palette, index_images = color_merge.build_palette({view: images[view] for view in views})
+
+    required = math.ceil(colors_threshold / 1.0)
+
+    def fill_region(x, y, z):
+        """Colors of the kept voxels in the block spanned by the coordinate arrays.
+        """
+        # keep the voxels with enough non-transparent projections, on bit-packed silhouettes
+        shape = (x.shape[0], y.shape[1], z.shape[2])
+        silhouettes = []
+
+        for view in views:
+            row, col = projection.pixel_coords(view, x, y, z, width, depth)
+            silhouettes.append(occupancy.pack_broadcast(images[view][row, col, 3] > 0, shape))
+
+        candidates = occupancy.at_least(silhouettes, required, shape)
+
+        # gather the projected colors of the remaining voxels, one column per view
+        local = np.nonzero(occupancy.unpack(candidates, shape[2]))
+        xs, ys, zs = x[local[0], 0, 0], y[0, local[1], 0], z[0, 0, local[2]]
+        projected = np.empty((len(xs), len(views), 4), dtype=float)
+        keys = np.empty((len(xs), len(views)), dtype=np.int64)
+
+        for i, view in enumerate(views):
+            row, col = projection.pixel_coords(view, xs, ys, zs, width, depth)
+            projected[:, i] = images[view][row, col]
+            if merge_technique == "MAJORITY_VOTE":
+                keys[:, i] = index_images[view][row, col]
+
+        valid = projected[:, :, 3] > 0
+
+        # per-voxel color variance over the valid projections only
+        count = valid.sum(axis=1)[:, None]
+        rgb = np.where(valid[:, :, None], projected[:, :, :3], 0.0)
+        mean = rgb.sum(axis=1) / count
+        deviation = np.where(valid[:, :, None], rgb - mean[:, None, :], 0.0)
+        variance = (deviation * deviation).sum(axis=1) / count
+        total_variance = variance.sum(axis=1)
+
+        in_concavity_zone = (_concavity_axis_mask(width, concavity_depth)[xs] |
+                             _concavity_axis_mask(depth, concavity_depth)[ys] |
+                             _concavity_axis_mask(height, concavity_depth)[zs])
+
+        kept = ~((total_variance > variance_threshold) & in_concavity_zone)
+        xs, ys, zs = xs[kept], ys[kept], zs[kept]
+        projected, valid, keys = projected[kept], valid[kept], keys[kept]
+
+        # finally, assign color based on merge technique
+        if merge_technique == "MAJORITY_VOTE":
+            return xs, ys, zs, color_merge.majority_vote(keys, valid, palette)
+
+        distances = color_merge.voxel_distances(views, xs, ys, zs, width, height, depth)
+        return xs, ys, zs, color_merge.nearest_projection(projected, valid, distances)
+
+    return projection.fill_grid(images, views, fill_region, required, width, height, depth,
+                                hollow_grid, chunk_size)
@@ -0,0 +1,131 @@
+"""
+This module implements the color merging techniques shared by the fill algorithms.
+"""
+from functools import lru_cache
+import numpy as np
+from . import projection
+
+def build_palette(images):
+    """Index the RGB colors of all images into one shared palette. The palette is sorted,
+    so comparing indices compares the colors themselves.
+
+    Args:
+        images: Images that were loaded through the panel
+
+    Returns:
+        Palette as an array of RGB colors, and a dictionary of palette indices
+        (one per pixel) for each view.
+    """
+    if not images:
+        return np.zeros((0, 3), dtype=float), {}
+
+    pixels = [image[:, :, :3].reshape(-1, 3) for image in images.values()]
+    palette, inverse = np.unique(np.concatenate(pixels), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    index_images = {}
+    offset = 0
+    for view, image in images.items():
+        size = image.shape[0] * image.shape[1]
+        index_images[view] = inverse[offset:offset + size].reshape(image.shape[:2])
+        offset += size
+
+    return palette, index_images
+
+def majority_vote(keys, valid, palette):
+    """Pick the most common color of each voxel across its valid projections.
+    Ties go to the lowest color.
+
+    Args:
+        keys: Palette indices of the projected colors, one row per voxel and one column per view
+        valid: Mask of the projections that are candidates, same shape as keys
+        palette: Palette the keys index into
+
+    Returns:
+        Array of RGBA colors, one per voxel, fully opaque.
+    """
+    colors = np.ones((len(keys), 4), dtype=float)
+    if keys.size == 0:
+        return colors
+
+    counts = np.zeros(keys.shape, dtype=np.int64)
+    for j in range(keys.shape[1]):
+        counts[:, j] = ((keys == keys[:, j:j + 1]) & valid).sum(axis=1)
+
+    # rank by count first, then prefer the lower palette index
+    score = np.where(valid, counts * (len(palette) + 1) + (len(palette) - keys), -1)
+    best = keys[np.arange(len(keys)), np.argmax(score, axis=1)]
+    colors[:, :3] = palette[best]
+
+    return colors
+
+@lru_cache(maxsize=16)
+def view_distances(width, height, depth):
+    """Distance of every voxel to the image plane of each view. The distances only depend
+    on the grid dimensions and are shared between calls.
+
+    Args:
+        width (int): Set width
+        height (int): Set height
+        depth (int): Set depth
+
+    Returns:
+        Dictionary of read-only distance arrays for each view, broadcastable to the
+        (x, y, z) grid where y runs over the depth and z over the height.
+    """
+    x, y, z = projection.grid_coords(width, height, depth)
+
+    distances = {
+        'FRONT': y,
+        'BACK': depth - 1 - y,
+        'LEFT': x,
+        'RIGHT': width - 1 - x,
+        'TOP': height - 1 - z,
+        'BOTTOM': z
+    }
+    for distance in distances.values():
+        distance.flags.writeable = False
+
+    return distances
+
+def voxel_distances(views, xs, ys, zs, width, height, depth):
+    """Gather the distances of a set of voxels to the image plane of each view.
+
+    Args:
+        views: Views to gather distances for, one column each
+        xs, ys, zs: Voxel coordinates
+        width (int): Set width
+        height (int): Set height
+        depth (int): Set depth
+
+    Returns:
+        Array of distances, one row per voxel and one column per view.
+    """
+    distances = view_distances(width, height, depth)
+    shape = projection.grid_sizes(width, height, depth)
+
+    gathered = np.zeros((len(xs), len(views)), dtype=int)
+    for i, view in enumerate(views):
+        gathered[:, i] = np.broadcast_to(distances[view], shape)[xs, ys, zs]
+
+    return gathered
+
+def nearest_projection(projected, valid, distances):
+    """Pick the color of each voxel from the closest view it has a valid projection in.
+    Ties go to the first of the closest views.
+
+    Args:
+        projected: Projected RGBA colors, one row per voxel and one column per view
+        valid: Mask of the projections that are candidates
+        distances: Distances of the voxels to the image plane of each view
+
+    Returns:
+        Array of RGBA colors, one per voxel.
+    """
+    if valid.size == 0:
+        return np.zeros((len(projected), 4), dtype=float)
+
+    masked = np.where(valid, distances, np.iinfo(np.int64).max)
+    nearest = np.argmin(masked, axis=1)
+
+    return projected[np.arange(len(projected)), nearest]
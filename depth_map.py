@@ -1,9 +1,11 @@
 """
 This module implements gradient-based depth estimation. 
 """
-from collections import deque
 import numpy as np
-from . import VoxelGrid
+from . import VoxelGrid, projection
+
+# largest number of voxels whose image overlap is counted at once
+DEPTH_SLAB_VOXELS = 1 << 24
 
 def calculate_depth(view, image, other_images, width, height, depth):
     """Estimate inital depth by intersecting input images and testing overlap positions.
@@ -21,300 +23,168 @@ def calculate_depth(view, image, other_images, width, height, depth):
     """
     depth_map = -np.ones((image.shape[0], image.shape[1]), dtype=int)
 
-    if view == 'FRONT':
-        for x in range (width):
-            for z in range (height):
-
-                if image[z, x, 3] != 0:
-
-                    max_overlap = -1
-                    max_overlap_idx = -1
-
-                    # compare each pixel in the image to all heights
-                    for y in range (depth):
-
-                        overlap = 0
-
-                        for v, img in other_images:
-                            if v == 'BACK' and img[z, width - 1 - x, 3] != 0:
-                                overlap += 1
-                            if v == 'LEFT' and img[z, depth - 1 - y, 3] != 0:
-                                overlap += 1
-                            if v == 'RIGHT' and img[z,y,3] != 0:
-                                overlap += 1
-                            if v == 'TOP' and img[y, x,3] != 0:
-                                overlap += 1
-                            if v == 'BOTTOM' and img[depth - 1 - y, x,3] != 0:
-                                overlap += 1
-
-
-                        if max_overlap < overlap:
-                            max_overlap = overlap
-                            max_overlap_idx = y
-
-                    depth_map[z, x] = max_overlap_idx
-
-                else:
-                    depth_map[z, x] = -1
-
-    elif view == 'BACK':
-        for x in range (width):
-            for z in range (height):
-
-                if image[z, width - 1 - x, 3] != 0:
-
-                    max_overlap = -1
-                    max_overlap_idx = -1
+    axis, reverse = projection.DEPTH_SCAN[view]
+    sizes = projection.grid_sizes(width, height, depth)
+    size = sizes[axis]
 
-                    # compare each pixel in the image to all heights
-                    for y in range (depth-1,0,-1):
+    # the rays are processed in slabs along another axis, so the overlap counts never
+    # need the whole grid at once
+    slab_axis = 1 if axis == 0 else 0
+    slab_size = max(DEPTH_SLAB_VOXELS // max(np.prod(sizes) // sizes[slab_axis], 1), 1)
 
-                        overlap = 0
+    silhouettes = [(v, img[..., 3] != 0) for v, img in other_images if v != view]
 
-                        for v, img in other_images:
-                            if v == 'FRONT' and img[z,x,3] != 0:
-                                overlap += 1
-                            if v == 'LEFT' and img[z, depth - 1 - y, 3] != 0:
-                                overlap += 1
-                            if v == 'RIGHT' and img[z,y,3] != 0:
-                                overlap += 1
-                            if v == 'TOP' and img[y, x,3] != 0:
-                                overlap += 1
-                            if v == 'BOTTOM' and img[depth - 1 - y, x,3] != 0:
-                                overlap += 1
+    ray_shape = list(sizes)
+    ray_shape[axis] = 1
+    max_overlap_idx = -np.ones(ray_shape, dtype=int)
 
+    for start in range(0, sizes[slab_axis], slab_size):
+        region = [slice(0, s) for s in sizes]
+        region[slab_axis] = slice(start, min(start + slab_size, sizes[slab_axis]))
+        x, y, z = projection.region_coords(region)
 
-                        if max_overlap < overlap:
-                            max_overlap = overlap
-                            max_overlap_idx = y
-                    
-                    depth_map[z, width - 1 - x] = max_overlap_idx
+        # number of other images that cover each voxel
+        overlap = np.zeros(tuple(s.stop - s.start for s in region), dtype=np.uint8)
+        for v, silhouette in silhouettes:
+            row, col = projection.pixel_coords(v, x, y, z, width, depth)
+            overlap += silhouette[row, col]
 
-                else:
-                    depth_map[z, width - 1 - x] = -1
+        # first position of maximum overlap along the scan direction of the view,
+        # reverse scans stop before reaching index 0
+        scan = [slice(None)] * 3
+        if reverse:
+            scan[axis] = slice(None, 0, -1)
+        scan = overlap[tuple(scan)]
 
-    elif view == 'LEFT': #images['LEFT'][z, depth - 1 - y]
-        for z in range (height):
-            for y in range (depth):
+        if scan.shape[axis] == 0:
+            continue
 
-                if image[z, depth-1-y, 3] != 0:
+        slab_idx = np.argmax(scan, axis=axis, keepdims=True)
+        target = list(region)
+        target[axis] = slice(None)
+        max_overlap_idx[tuple(target)] = size - 1 - slab_idx if reverse else slab_idx
 
-                    max_overlap = -1
-                    max_overlap_idx = -1
+    row, col = projection.ray_pixels(view, width, height, depth)
 
-                    # compare each pixel in the image to all heights
-                    for x in range (width):
-
-                        overlap = 0
-
-                        for v, img in other_images:
-                            if v == 'FRONT' and img[z,x,3] != 0:
-                                overlap += 1
-                            if v == 'BACK' and img[z, width - 1 - x, 3] != 0:
-                                overlap += 1
-                            if v == 'RIGHT' and img[z,y,3] != 0:
-                                overlap += 1
-                            if v == 'TOP' and img[y, x,3] != 0:
-                                overlap += 1
-                            if v == 'BOTTOM' and img[depth - 1 - y, x,3] != 0:
-                                overlap += 1
-
-
-                        if max_overlap < overlap:
-                            max_overlap = overlap
-                            max_overlap_idx = x
-                    
-                    depth_map[z, depth-1-y] = max_overlap_idx
-
-                else:
-                    depth_map[z, depth-1-y] = -1
-
-    elif view == 'RIGHT':
-        for z in range (height):
-            for y in range (depth):
-
-                if image[z, y, 3] != 0:
-
-                    max_overlap = -1
-                    max_overlap_idx = -1
-
-                    # compare each pixel in the image to all heights
-                    for x in range (width-1,0,-1):
-
-                        overlap = 0
-
-                        for v, img in other_images:
-                            if v == 'FRONT' and img[z,x,3] != 0:
-                                overlap += 1
-                            if v == 'BACK' and img[z, width - 1 - x, 3] != 0:
-                                overlap += 1
-                            if v == 'LEFT' and img[z,depth-1-y,3] != 0:
-                                overlap += 1
-                            if v == 'TOP' and img[y, x,3] != 0:
-                                overlap += 1
-                            if v == 'BOTTOM' and img[depth - 1 - y, x,3] != 0:
-                                overlap += 1
+    # transparent pixels stay at -1, skip them when merging
+    depth_map[row, col] = np.where(image[row, col, 3] != 0, max_overlap_idx, -1)
 
+    return depth_map
 
-                        if max_overlap < overlap:
-                            max_overlap = overlap
-                            max_overlap_idx = x
-                    
-                    depth_map[z, y] = max_overlap_idx
+def sobel(image):
+    """Calculate sobel gradients, as weighted sums of shifted copies of the edge-padded image.
+    The terms are added in the same order as numpy sums each flattened 3x3 window.
 
-                else:
-                    depth_map[z, y] = -1
+    Args:
+        image: Image to compute gradients over, or a stack of equally sized images 
+        with the image axes last
 
-    elif view == 'TOP':
-        # images['TOP'][y, x]
-        for x in range (width):
-            for y in range (depth):
-
-                if image[y, x, 3] != 0:
-
-                    max_overlap = -1
-                    max_overlap_idx = -1
-
-                    # compare each pixel in the image to all heights
-                    for z in range (height-1,0,-1):
+    Returns:
+        _type_: Sobel gradients, magnitude and x and y components.
+    """
+    h, w = image.shape[-2:]
+    pad_width = [(0, 0)] * (image.ndim - 2) + [(1, 1), (1, 1)]
+    padded = np.pad(image, pad_width=pad_width, mode='edge')
 
-                        overlap = 0
+    def shifted(dy, dx):
+        return padded[..., 1 + dy:h + 1 + dy, 1 + dx:w + 1 + dx]
 
-                        for v, img in other_images:
-                            if v == 'FRONT' and img[z,x,3] != 0:
-                                overlap += 1
-                            if v == 'BACK' and img[z, width - 1 - x, 3] != 0:
-                                overlap += 1
-                            if v == 'LEFT' and img[z, depth - 1 - y, 3] != 0:
-                                overlap += 1
-                            if v == 'RIGHT' and img[z,y,3] != 0:
-                                overlap += 1
-                            if v == 'BOTTOM' and img[depth - 1 - y, x,3] != 0:
-                                overlap += 1
+    gx = (((-shifted(-1, -1) + (shifted(-1, 1) + -2 * shifted(0, -1))) +
+           (2 * shifted(0, 1) + -shifted(1, -1))) + shifted(1, 1))
+    gy = (((-shifted(-1, -1) + -2 * shifted(-1, 0)) + -shifted(-1, 1)) +
+          (shifted(1, -1) + 2 * shifted(1, 0))) + shifted(1, 1)
 
+    grad_mag = np.sqrt(gx**2 + gy**2)
+    return grad_mag, gx, gy
 
-                        if max_overlap < overlap:
-                            max_overlap = overlap
-                            max_overlap_idx = z
-                    
-                    depth_map[y, x] = max_overlap_idx
+def label_components(mask):
+    """Label the 4-connected regions of a mask, using union-find over all pairs of neighbouring 
+    pixels at once. Roots are hooked onto the smaller root of each pair and paths are then 
+    compressed, until every pair shares a root.
 
-                else:
-                    depth_map[y, x] = -1 # transparent pixel, skip it when merging
+    Args:
+        mask: 2D boolean array, or a stack of equally sized masks with the image axes last; 
+        regions never extend across masks in a stack
 
-    elif view == 'BOTTOM':
-        # images['BOTTOM'][depth - 1 - y, x]
-        for x in range (width):
-            for y in range (depth):
-
-                if image[depth - 1 - y, x, 3] != 0:
-
-                    max_overlap = -1
-                    max_overlap_idx = -1
-
-                    # compare each pixel in the image to all heights
-                    for z in range (height):
+    Returns:
+        Array of labels of the same shape as the mask, 0 for the background and 1..n for the 
+        regions in raster order, and the size of each label (0 for the background)
+    """
+    mask = np.asarray(mask, dtype=bool)
+    parent = np.arange(mask.size)
+    index = parent.reshape(mask.shape)
+
+    right = mask[..., :, :-1] & mask[..., :, 1:]
+    down = mask[..., :-1, :] & mask[..., 1:, :]
+    a = np.concatenate([index[..., :, :-1][right], index[..., :-1, :][down]])
+    b = np.concatenate([index[..., :, 1:][right], index[..., 1:, :][down]])
+
+    while True:
+        root_a = parent[a]
+        root_b = parent[b]
+        unmerged = root_a != root_b
+        if not unmerged.any():
+            break
+
+        a, b = a[unmerged], b[unmerged]
+        root_a, root_b = root_a[unmerged], root_b[unmerged]
+        np.minimum.at(parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+    foreground = mask.ravel()
+    labels = np.zeros(mask.size, dtype=np.int64)
+    _, region = np.unique(parent[foreground], return_inverse=True)
+    labels[foreground] = region + 1
+
+    sizes = np.bincount(labels, minlength=1)
+    sizes[0] = 0
+
+    return labels.reshape(mask.shape), sizes
 
-                        overlap = 0
+def connected_components(mask, min_size=5):
+    """Keep the 4-connected regions of a mask that are large enough.
 
-                        for v, img in other_images:
-                            if v == 'FRONT' and img[z,x,3] != 0:
-                                overlap += 1
-                            if v == 'BACK' and img[z, width - 1 - x, 3] != 0:
-                                overlap += 1
-                            if v == 'LEFT' and img[z, depth - 1 - y, 3] != 0:
-                                overlap += 1
-                            if v == 'RIGHT' and img[z,y,3] != 0:
-                                overlap += 1
-                            if v == 'TOP' and img[y, x,3] != 0:
-                                overlap += 1
+    Args:
+        mask: 2D array of values over which the algorithm computes region sizes, 
+        or a stack of equally sized masks
+        min_size (int, optional): Minimum region size to filter. Defaults to 5.
 
+    Returns:
+        Regions where size is greater than or equal to the minimum size
+    """
+    labels, sizes = label_components(mask)
 
-                        if max_overlap < overlap:
-                            max_overlap = overlap
-                            max_overlap_idx = z
-                    
-                    depth_map[depth - 1 - y, x] = max_overlap_idx
-
-                else:
-                    depth_map[depth - 1 - y, x] = -1 # transparent pixel, skip it when merging
+    keep = sizes >= min_size
+    keep[0] = False
 
-    return depth_map
+    return keep[labels]
 
-def sobel(image):
-    """Calculate sobel gradients 
+def concavity_candidates(image, intensity_threshold=1.0):
+    """Find the pixels of the object in the image with a low enough flipped gradient magnitude.
 
     Args:
-        image: Image to compute gradients over
+        image: Chosen image, or a stack of equally sized images
+        intensity_threshold (float): Intensity cutoff threshold
 
     Returns:
-        _type_: Sobel gradients, magnitude and x and y components.
+        Boolean mask of candidate concave pixels, one per image
     """
-    sobel_x = np.array([
-        [-1, 0, 1],
-        [-2, 0, 2],
-        [-1, 0, 1]
-    ])
-
-    sobel_y = np.array([
-        [-1, -2, -1],
-        [ 0,  0,  0],
-        [ 1,  2,  1]
-    ])
-
-    h, w = image.shape
-    gx = np.zeros((h, w))
-    gy = np.zeros((h, w))
-
-    padded = np.pad(image, pad_width=1, mode='edge')
-
-    for y in range(1, h + 1):
-        for x in range(1, w + 1):
-            region = padded[y-1:y+2, x-1:x+2]
-            gx[y-1, x-1] = np.sum(region * sobel_x)
-            gy[y-1, x-1] = np.sum(region * sobel_y)
-
-    grad_mag = np.sqrt(gx**2 + gy**2)
-    return grad_mag, gx, gy
+    gray = np.mean(image[..., :3], axis=-1)
+    grad_mag, _, _ = sobel(gray)
 
-def connected_components(mask, min_size=5):
-    """Connected components algorithm based on:
-        https://www.geeksforgeeks.org/flood-fill-algorithm/ 
+    alpha = image[..., 3]
+    object_mask = alpha > 0.1
 
-    Args:
-        mask: 2D array of values over which the algorithm computes region sizes
-        min_size (int, optional): Minimum region size to filter. Defaults to 5.
+    flipped_mags = np.zeros_like(grad_mag)
+    flipped_mags[object_mask] = 1.0 - grad_mag[object_mask]
 
-    Returns:
-        Regions where size is greater than or equal to the minimum size
-    """
-    h, w = mask.shape
-    visited = np.zeros_like(mask, dtype=bool)
-    output_mask = np.zeros_like(mask, dtype=bool)
-
-    for y in range(h):
-        for x in range(w):
-            if mask[y, x] and not visited[y, x]:
-                queue = deque()
-                queue.append((y, x))
-                region_pixels = []
-
-                while queue:
-                    cy, cx = queue.popleft()
-                    if (0 <= cy < h and 0 <= cx < w and
-                        mask[cy, cx] and not visited[cy, cx]):
-                        visited[cy, cx] = True
-                        region_pixels.append((cy, cx))
-                        queue.extend([
-                            (cy-1, cx), (cy+1, cx),
-                            (cy, cx-1), (cy, cx+1)
-                        ])
-
-                if len(region_pixels) >= min_size:
-                    for py, px in region_pixels:
-                        output_mask[py, px] = True
-
-    return output_mask
+    return ((flipped_mags < intensity_threshold) &
+            (flipped_mags > 0.0) & (object_mask))
 
 def estimate_using_gradients(view,
                             image,
@@ -326,7 +196,8 @@ def estimate_using_gradients(view,
                             concavity_depth=0.5,
                             factor = 1,
                             min_region_size=5,
-                            keep_concave_regions=True):
+                            keep_concave_regions=True,
+                            valid_regions=None):
     """Calculate gradients of the input image, use the values to update the initial depth map.
 
     Args:
@@ -342,98 +213,114 @@ def estimate_using_gradients(view,
         min_region_size (float): Minimum size of concave regions
         keep_concave_regions (bool): Choice of whether voxels in concave regions should 
         be in the final model
+        valid_regions (optional): Precomputed concave regions of the image. Computed from 
+        the image when not given.
 
     Returns:
         The final depth map after using updating the initial map with selected intensity values.
     """
     gray = np.mean(image[:, :, :3], axis=2)
-    h, w = gray.shape
-    grad_mag, _, _ = sobel(gray)
 
-    alpha = image[:, :, 3]
-    object_mask = alpha > 0.1
+    if valid_regions is None:
+        valid_regions = connected_components(concavity_candidates(image, intensity_threshold),
+                                             min_size=min_region_size)
 
-    flipped_mags = np.zeros_like(grad_mag)
-    flipped_mags[object_mask] = 1.0 - grad_mag[object_mask]
+    depth_map = curr_depth_map.astype(np.float32)
 
-    concavity_candidates = ((flipped_mags < intensity_threshold) &
-                            (flipped_mags > 0.0) & (object_mask))
+    if keep_concave_regions:
+        multiplier = 1 * concavity_depth * (1 - gray * factor)
 
-    valid_regions = connected_components(concavity_candidates, min_size=min_region_size)
+        # push concave regions further along the view axis
+        axis, reverse = projection.DEPTH_SCAN[view]
+        offset = projection.grid_sizes(width, height, depth)[axis] * multiplier
+        if reverse:
+            concave_depth_map = curr_depth_map - offset
+        else:
+            concave_depth_map = curr_depth_map + offset
 
-    depth_map = curr_depth_map.astype(np.float32)
+        depth_map[valid_regions] = concave_depth_map[valid_regions]
 
-    for y in range(h):
-        for x in range(w):
-            intensity = gray[y, x]
-            if valid_regions[y, x]:
-                if keep_concave_regions:
-                    multiplier = 1 * concavity_depth * (1 - intensity * factor)
-
-                    if view == 'FRONT':
-                        depth_map[y, x] = curr_depth_map[y, x] + depth*multiplier
-                    elif view == 'BACK':
-                        depth_map[y, x] = curr_depth_map[y, x] - depth*multiplier
-                    elif view == 'LEFT':
-                        depth_map[y, x] = curr_depth_map[y, x] + width*multiplier
-                    elif view == 'RIGHT':
-                        depth_map[y, x] = curr_depth_map[y, x] - width*multiplier
-                    elif view == 'TOP':
-                        depth_map[y, x] = curr_depth_map[y, x] - height*multiplier
-                    elif view == 'BOTTOM':
-                        depth_map[y, x] = curr_depth_map[y, x] + height*multiplier
-
-                else:
-                    depth_map[y, x] = -1
+    else:
+        depth_map[valid_regions] = -1
 
     final = depth_map.astype(np.int32)
     return final
 
-def intersect_maps(depth_maps, images, width, height, depth):
+def intersect_maps(depth_maps, images, width, height, depth, chunk_size=None):
     """Intersect the calculated depth maps into the final grid.
 
+    Every non-transparent depth map pixel writes its color to a single voxel. Where several
+    pixels write the same voxel, the write that comes last in an x, z, y sweep of the grid wins,
+    with every pixel placed at the far end of its view's axis and ties going to the later view
+    in depth_maps. In practice, LEFT and RIGHT take precedence over TOP and BOTTOM, which take
+    precedence over FRONT and BACK, except on the far faces of the grid.
+
     Args:
         depth_maps: Depth maps for each image
         images: Selected set of images
         width (int): Set width
         height (int): Set height
         depth (int): Set depth
+        chunk_size (int, optional): Write the voxels into a chunked grid with chunks of 
+        this size. Defaults to None, which returns a dense grid.
 
     Returns:
         Final 3D grid.
     """
-    voxel_grid = VoxelGrid.VoxelGrid(width, height, depth)
-    colors = np.zeros((width, height, depth, 4), dtype=float)
-
-    for x in range (width):
-        for z in range (height):
-            for y in range (depth):
-
-                for view, dmap in depth_maps.items():
-
-                    #front view
-                    if view == 'FRONT' and dmap[z,x] != -1:
-                        colors[x, dmap[z, x], z] = images['FRONT'][z, x]
-                    #back view
-                    elif view == 'BACK' and dmap[z,width-1-x] != -1:
-                        colors[x, dmap[z, width - 1 - x], z] = images['BACK'][z, width - 1 - x]
-                    #left view
-                    elif view == 'LEFT' and dmap[z,depth-1-y] != -1:
-                        colors[dmap[z, depth - 1 - y], y, z] = images['LEFT'][z, depth - 1 - y]
-                    #right view
-                    elif view == 'RIGHT' and dmap[z,y] != -1:
-                        colors[dmap[z, y], y, z] = images['RIGHT'][z, y]
-                    #top view
-                    elif view == 'TOP' and dmap[y,x] != -1:
-                        colors[x, y, dmap[y, x]] = images['TOP'][y, x]
-                    #bottom view
-                    elif view == 'BOTTOM' and dmap[depth-1-y,x] != -1:
-                        colors[x, y, dmap[depth - 1 - y, x]] = images['BOTTOM'][depth - 1 - y, x]
-
-    voxel_grid.colors = colors
+    shape = (width, height, depth)
+    sizes = projection.grid_sizes(width, height, depth)
+    x, y, z = projection.grid_coords(width, height, depth)
+
+    targets = []
+    sweep_order = []
+    values = []
+
+    for i, (view, dmap) in enumerate(depth_maps.items()):
+        axis, _ = projection.DEPTH_SCAN[view]
+        coords = [x, y, z]
+        coords[axis] = np.full((1, 1, 1), sizes[axis] - 1)
+        row, col = projection.ray_pixels(view, width, height, depth)
+
+        view_depth = dmap[row, col]
+        written = view_depth != -1
+
+        sweep = [np.broadcast_to(c, row.shape)[written] for c in coords]
+        target = list(sweep)
+        target[axis] = view_depth[written]
+
+        targets.append(target)
+        sweep_order.append(((sweep[0] * height + sweep[2]) * depth + sweep[1]) * len(depth_maps) + i)
+        values.append(images[view][row[written], col[written]])
+
+    if targets:
+        # negative depths index from the end, as they would in a direct assignment
+        target = [np.concatenate(t) for t in zip(*targets)]
+        target = [np.where(t < 0, t + size, t) for t, size in zip(target, shape)]
+        flat_target = np.ravel_multi_index(target, shape)
+        sweep_order = np.concatenate(sweep_order)
+        values = np.concatenate(values)
+
+        # keep only the last write to every voxel
+        order = np.lexsort((sweep_order, flat_target))
+        flat_target = flat_target[order]
+        last = np.ones(len(flat_target), dtype=bool)
+        last[:-1] = flat_target[1:] != flat_target[:-1]
+        flat_target = flat_target[last]
+        values = values[order[last]]
+
+    else:
+        flat_target = np.zeros(0, dtype=np.int64)
+        values = np.zeros((0, 4), dtype=float)
+
+    if chunk_size:
+        voxel_grid = VoxelGrid.ChunkedVoxelGrid(width, height, depth, chunk_size)
+    else:
+        voxel_grid = VoxelGrid.VoxelGrid(width, height, depth)
+
+    voxel_grid.set_voxels(*np.unravel_index(flat_target, shape), values)
     return voxel_grid
 
-def generate_final_grid(images,
+def estimate_depth_maps(images,
                         width,
                         height,
                         depth,
@@ -442,7 +329,8 @@ def generate_final_grid(images,
                         factor,
                         min_region_size,
                         keep_concave_regions):
-    """Generate the grid using depth estimation. 
+    """Estimate the final depth map of every image. The concave regions of all images are 
+    labelled together, as one stack of masks padded to a common size.
 
     Args:
         images: Images that were loaded through the panel
@@ -457,12 +345,34 @@ def generate_final_grid(images,
         be in the final model
 
     Returns:
-        The final 3D grid as a color array. 
+        Dictionary of depth maps for each view.
     """
-
     depth_maps = {}
 
+    if not images:
+        return depth_maps
+
+    # images of the same size go through the gradient filter together
+    views_by_shape = {}
     for view, image in images.items():
+        views_by_shape.setdefault(image.shape, []).append(view)
+
+    candidates_by_view = {}
+    for views in views_by_shape.values():
+        stack = concavity_candidates(np.stack([images[view] for view in views]), intensity_threshold)
+        candidates_by_view.update(zip(views, stack))
+
+    candidates = [candidates_by_view[view] for view in images]
+
+    stacked = np.zeros((len(candidates),
+                        max(c.shape[0] for c in candidates),
+                        max(c.shape[1] for c in candidates)), dtype=bool)
+    for i, c in enumerate(candidates):
+        stacked[i, :c.shape[0], :c.shape[1]] = c
+
+    regions = connected_components(stacked, min_size=min_region_size)
+
+    for i, (view, image) in enumerate(images.items()):
         other_images = [(v, img) for v, img in images.items() if v != view]
 
         curr_depth_map = calculate_depth(view, image, other_images, width, height, depth)
@@ -472,15 +382,57 @@ def generate_final_grid(images,
                                                     curr_depth_map,
                                                     width,
                                                     height,
-                                                    depth, 
+                                                    depth,
                                                     intensity_threshold,
                                                     concavity_depth,
                                                     factor,
                                                     min_region_size,
-                                                    keep_concave_regions)
+                                                    keep_concave_regions,
+                                                    regions[i, :image.shape[0], :image.shape[1]])
 
         depth_maps[view] = final_depth_map
 
-    grid = intersect_maps(depth_maps, images, width, height, depth)
+    return depth_maps
+
+def generate_final_grid(images,
+                        width,
+                        height,
+                        depth,
+                        intensity_threshold,
+                        concavity_depth,
+                        factor,
+                        min_region_size,
+                        keep_concave_regions,
+                        chunk_size=None):
+    """Generate the grid using depth estimation. 
+
+    Args:
+        images: Images that were loaded through the panel
+        width (int): Set width
+        height (int): Set height
+        depth (int): Set depth
+        intensity_threshold (float): Intensity cutoff threshold
+        concavity_depth (float): Concavity depth multiplier
+        factor (float): Factor multipler
+        min_region_size (float): Minimum size of concave regions
+        keep_concave_regions (bool): Choice of whether voxels in concave regions should 
+        be in the final model
+        chunk_size (int, optional): Return a chunked grid with chunks of this size. 
+        Defaults to None.
+
+    Returns:
+        The final 3D grid as a color array. 
+    """
+    depth_maps = estimate_depth_maps(images,
+                                     width,
+                                     height,
+                                     depth,
+                                     intensity_threshold,
+                                     concavity_depth,
+                                     factor,
+                                     min_region_size,
+                                     keep_concave_regions)
+
+    grid = intersect_maps(depth_maps, images, width, height, depth, chunk_size)
 
     return grid
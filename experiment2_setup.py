@@ -46,6 +46,9 @@ def load_subset_images(obj_folder, views):
         pixels_np = np.array(image.pixels[:]).reshape((h, w, 4))
         pixels_np = np.round(pixels_np, 3)
         images[view] = pixels_np
+
+        # the pixels are copied, so the image datablock is not needed anymore
+        bpy.data.images.remove(image)
     return images
 
 def render_from_view(obj, cam, view_name, save_path, ortho_scale=30):
@@ -75,7 +78,8 @@ def render_from_view(obj, cam, view_name, save_path, ortho_scale=30):
 
     bpy.ops.render.render(write_still=True)
 
-def run_experiment2_setup(camera_ref):
+def run_experiment2_setup(camera_ref, greedy=False):
+    # greedy meshing changes the rendered topology, so the experiment keeps it off unless asked
     for obj_name in os.listdir(assets_path):
         obj_dir = os.path.join(assets_path, obj_name)
         if not os.path.isdir(obj_dir) or obj_name not in size_map:
@@ -169,7 +173,9 @@ def run_experiment2_setup(camera_ref):
 
             for algo_name, merge_strategy, grid in results:
                 # Generate a unique mesh object
-                obj = generate_mesh.generate_mesh_from_grid(grid.colors, obj_name=f"{obj_name}_{algo_name}_{merge_strategy}")
+                obj = generate_mesh.generate_mesh_from_grid(grid,
+                                                            greedy=greedy,
+                                                            obj_name=f"{obj_name}_{algo_name}_{merge_strategy}")
 
                 if obj.name not in bpy.context.collection.objects:
                     bpy.context.collection.objects.link(obj)
@@ -194,6 +200,6 @@ def run_experiment2_setup(camera_ref):
 
                     render_from_view(obj, camera_ref, view, out_path, ortho_scale=size_map[obj_name])
 
-                bpy.data.objects.remove(obj, do_unlink=True)
+                generate_mesh.delete_mesh_object(obj.name)
 
 
@@ -1,53 +1,73 @@
+"""
+Converts the experiment 1 .vox models to ground truth grids. The .vox reader lives at the
+plugin root and only needs NumPy, so run this as a module from the plugin root:
+
+    python -m experiments.exp1.export
+"""
+import argparse
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
-from voxypy.models import Entity
+import vox_io
+
+experiment_root = os.path.dirname(os.path.abspath(__file__))
 
 def extract_from_file(path):
-    # Load the .vox into a VoxyPy Entity
-    entity = Entity().from_file(path)
-    palette = entity.get_palette()  # list of RGB(A) tuples
-    dense = entity.get_dense()      # shape: (X, Y, Z), values are color indices
-    
-    # Create RGB color grid
-    X, Y, Z = dense.shape
-    color_grid = np.zeros((X, Y, Z, 4), dtype=np.uint8)
-    
-    for idx in np.unique(dense):
-        if idx == 0:
-            continue  # index 0 is empty/blank
-        rgb = palette[idx]
-        color_grid[dense == idx] = rgb
-    
-    return color_grid
+    # Load the .vox palette (RGBA tuples) and dense grid of color indices, shape (X, Y, Z)
+    palette, dense = vox_io.read_vox(path, normalize=False)
+
+    # Create RGB color grid, index 0 is empty/blank and maps to (0,0,0,0)
+    return palette[dense]
 
 def save_color_grid(grid, out_path):
+    x_size, y_size, z_size, _ = grid.shape
+
+    # format every distinct color once, then look the strings up per voxel
+    colors, inverse = np.unique(grid.reshape(-1, 4), axis=0, return_inverse=True)
+    tokens = np.array([f"({r},{g},{b},{a})" for r, g, b, a in colors], dtype=object)
+    voxel_tokens = tokens[inverse.reshape(x_size, y_size, z_size)]
+
+    lines = [f"# Shape: ({x_size}, {y_size}, {z_size})\n"]
+    for z in range(z_size):
+        lines.append(f"\n# Layer z={z}\n")
+        lines.extend(" ".join(voxel_tokens[:, y, z]) + "\n" for y in range(y_size))
+
     with open(out_path, 'w') as f:
-        x_size, y_size, z_size, _ = grid.shape
-        f.write(f"# Shape: ({x_size}, {y_size}, {z_size})\n")
-        for z in range(z_size):
-            f.write(f"\n# Layer z={z}\n")
-            for y in range(y_size):
-                row = []
-                for x in range(x_size):
-                    r, g, b, a = grid[x, y, z] 
-                    row.append(f"({r},{g},{b},{a})")
-                f.write(" ".join(row) + "\n")
+        f.writelines(lines)
+
+def convert_model(input_path, output_dir, binary=False):
+    model_name = os.path.splitext(os.path.basename(input_path))[0]
+    print(f"Processing {model_name}...")
+
+    color_grid = extract_from_file(input_path)
+
+    # the binary ground truth is the uint8 color grid, loaded as is by generate_comparison_grid
+    if binary:
+        output_path = os.path.join(output_dir, f"{model_name}.npy")
+        np.save(output_path, color_grid)
+    else:
+        output_path = os.path.join(output_dir, f"{model_name}.txt")
+        save_color_grid(color_grid, output_path)
+
+    return output_path
 
 def main():
-    input_dir = './models'
-    output_dir = './ground_truth'
-    os.makedirs(output_dir, exist_ok=True)
-
-    for filename in os.listdir(input_dir):
-        if filename.endswith('.vox'):
-            input_path = os.path.join(input_dir, filename)
-            model_name = os.path.splitext(filename)[0]
-            print("model name " + model_name)
-            output_path = os.path.join(output_dir, f"{model_name}.txt")
-
-            print(f"Processing {filename}...")
-            color_grid = extract_from_file(input_path)
-            save_color_grid(color_grid, output_path)
+    parser = argparse.ArgumentParser(description="Convert .vox models to ground truth grids.")
+    parser.add_argument('--input-dir', default=os.path.join(experiment_root, 'models'))
+    parser.add_argument('--output-dir', default=os.path.join(experiment_root, 'ground_truth'))
+    parser.add_argument('--binary', action='store_true', help="write .npy grids instead of text")
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    input_paths = [os.path.join(args.input_dir, filename)
+                   for filename in sorted(os.listdir(args.input_dir))
+                   if filename.endswith('.vox')]
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(convert_model, path, args.output_dir, args.binary) for path in input_paths]
+        for future in as_completed(futures):
+            print(f"Wrote {future.result()}")
 
     print("Done.")
 
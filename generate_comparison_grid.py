@@ -1,12 +1,15 @@
 """
 This module generates the ground truth model from its .txt file.
 """
+import hashlib
+import os
 import re
+import tempfile
 import bpy
 import bmesh
 import numpy as np
 import mathutils
-from . import generate_mesh
+from . import generate_mesh, VoxelGrid, occupancy, vox_io
 
 def srgb_to_linear(arr):
     """Convert sRGB values to linear RGB, important for displaying the right colors in Blender 
@@ -28,17 +31,20 @@ def srgb_to_linear(arr):
 
     return np.concatenate((rgb_linear, alpha), axis=-1)
 
-def load_color_grid_from_txt(path):
-    """Loads the color grid from a .txt file (used to generate a grid from the ground truth models).
+# voxel colors of the layer text format, as (r,g,b,a) tuples of ints
+COLOR_TUPLE = re.compile(r'\((\d+,\d+,\d+,\d+)\)')
+
+def parse_color_grid(text):
+    """Parses the layer text format of the ground truth models. The colors of all rows are 
+    collected first, then converted and written to the grid in one pass.
 
     Args:
-        path (string): Path to file
+        text (string): Contents of a ground truth .txt file
 
     Returns:
         Read grid.
     """
-    with open(path, 'r') as f:
-        lines = f.readlines()
+    lines = text.splitlines()
 
     # extract shape from first line
     shape_line = lines[0]
@@ -49,6 +55,11 @@ def load_color_grid_from_txt(path):
     x_size, y_size, z_size = map(int, shape_match.groups())
     grid = np.zeros((x_size, y_size, z_size, 4), dtype=np.float32)  # RGBA normalized to [0.0, 1.0]
 
+    tuples = []
+    row_y = []
+    row_z = []
+    row_lengths = []
+
     z = -1
     y = 0
     for line in lines[1:]:
@@ -59,15 +70,81 @@ def load_color_grid_from_txt(path):
             z = int(re.search(r'z=(\d+)', line).group(1))
             y = 0
             continue
-        # parse RGBA tuples as ints
-        color_tuples = re.findall(r'\((\d+),(\d+),(\d+),(\d+)\)', line)
-        for x, (r, g, b, a) in enumerate(color_tuples):
-            rgba = np.array([int(r), int(g), int(b), int(a)], dtype=np.float32) / 255.0
-            grid[x, y, z] = rgba
+        row = COLOR_TUPLE.findall(line)
+        tuples.extend(row)
+        row_y.append(y)
+        row_z.append(z)
+        row_lengths.append(len(row))
         y += 1
 
+    if tuples:
+        rgba = np.fromstring(','.join(tuples), dtype=np.int64, sep=',').reshape(-1, 4)
+        rgba = rgba.astype(np.float32) / 255.0
+        row_lengths = np.array(row_lengths)
+        starts = np.repeat(np.cumsum(row_lengths) - row_lengths, row_lengths)
+        x = np.arange(len(tuples)) - starts
+        grid[x, np.repeat(row_y, row_lengths), np.repeat(row_z, row_lengths)] = rgba
+
+    return grid
+
+def load_color_grid_from_txt(path, use_cache=True):
+    """Loads the color grid from a .txt file (used to generate a grid from the ground truth models).
+    The parsed grid is cached in a .npz file next to it, together with the hash of the text, 
+    and reused for as long as the text does not change.
+
+    Args:
+        path (string): Path to file
+        use_cache (bool, optional): Read and write the cache file. Defaults to True.
+
+    Returns:
+        Read grid.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    digest = hashlib.sha1(data).hexdigest()
+    cache_path = path + '.npz'
+
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as cached:
+                if str(cached['digest']) == digest:
+                    return cached['grid']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    grid = parse_color_grid(data.decode())
+
+    if use_cache:
+        # write to a temporary file first, parallel jobs may cache the same model
+        try:
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)),
+                                             suffix='.npz', delete=False) as f:
+                np.savez(f, digest=digest, grid=grid)
+            os.replace(f.name, cache_path)
+        except OSError:
+            pass
+
     return grid
 
+def load_reference_grid(path):
+    """Loads a ground truth grid, from a MagicaVoxel .vox file or from its .txt or .npy export.
+
+    Args:
+        path (string): Path to file
+
+    Returns:
+        Read grid, with the same float32 values for every format.
+    """
+    if path.lower().endswith('.vox'):
+        palette, indices = vox_io.read_vox(path)
+        return palette[indices]
+
+    if path.lower().endswith('.npy'):
+        return np.load(path).astype(np.float32) / 255.0
+
+    return load_color_grid_from_txt(path)
+
 def rotate_voxel_grid_for_blender(grid):
     """Rotates MagicaVoxel models to default Blender orientation.
     """
@@ -76,38 +153,11 @@ def rotate_voxel_grid_for_blender(grid):
 
     return grid
 
-def hollow_out_grid(colors):
+def hollow_out_grid(colors, connectivity=26):
     """
         Produce a hollow version of the grid to improve performance.
     """
-    width, height, depth, _ = colors.shape
-    hollow_grid = np.copy(colors)
-
-    for x in range(1, width - 1):
-        for y in range(1, height - 1):
-            for z in range(1, depth - 1):
-                if colors[x, y, z][3] == 0:
-                    continue
-
-                fully_surrounded = True
-                for dx in (-1, 0, 1):
-                    for dy in (-1, 0, 1):
-                        for dz in (-1, 0, 1):
-                            if dx == dy == dz == 0:
-                                continue  # skip center
-                            neighbor = colors[x + dx, y + dy, z + dz]
-                            if neighbor[3] == 0:
-                                fully_surrounded = False
-                                break
-                        if not fully_surrounded:
-                            break
-                    if not fully_surrounded:
-                        break
-
-                if fully_surrounded:
-                    hollow_grid[x, y, z] = [0, 0, 0, 0]  # mark as hollow (transparent)
-
-    return hollow_grid
+    return VoxelGrid.hollow_out_grid(colors, connectivity)
 
 def compute_color_mse(grid1, grid2, ignore_transparent=True, tol=1e-3):
     """Computes the MSE scores for the color values between two grids. 
@@ -135,6 +185,36 @@ def compute_color_mse(grid1, grid2, ignore_transparent=True, tol=1e-3):
     mse = np.mean((flat1[:, :3] - flat2[:, :3]) ** 2)
     return mse
 
+def compute_sparse_scores(grid1, grid2, tol=1e-3):
+    """Computes the IoU and color MSE scores between two sparse grids, the sparse counterpart 
+    of the dense scoring in generate_comp. Voxels missing from a grid count as all zero.
+
+    Args:
+        grid1 (SparseVoxelGrid): First grid
+        grid2 (SparseVoxelGrid): Second grid
+        tol (float, optional): Tolerance threshold for the MSE. Defaults to 1e-3.
+
+    Returns:
+        Computed IoU and MSE scores.
+    """
+    keys = np.union1d(grid1.keys, grid2.keys)
+    colors1 = np.zeros((len(keys), 4), dtype=float)
+    colors2 = np.zeros((len(keys), 4), dtype=float)
+    colors1[np.searchsorted(keys, grid1.keys)] = grid1.voxel_colors()
+    colors2[np.searchsorted(keys, grid2.keys)] = grid2.voxel_colors()
+
+    occupied1 = colors1[:, 3] == 1.0
+    occupied2 = colors2[:, 3] == 1.0
+
+    intersection = np.logical_and(occupied1, occupied2).sum()
+    union = np.logical_or(occupied1, occupied2).sum()
+
+    iou = intersection / union if union > 0 else 0.0
+
+    mse = compute_color_mse(colors1, colors2, tol=tol)
+
+    return iou, mse
+
 def generate_comp(ref_file, gen_model, draw_comp=False, tol=1e-3, remove_gamma_correction=True):
     """Compute IoU for float RGBA voxel grids in [0.0, 1.0],
     ignoring voxels where alpha == 0.0 in both grids.
@@ -142,8 +222,8 @@ def generate_comp(ref_file, gen_model, draw_comp=False, tol=1e-3, remove_gamma_c
     `tol` is the per-channel tolerance.
 
     Args:
-        ref_file: Ground truth model .txt file
-        gen_model: Generated voxel object
+        ref_file: Ground truth model .vox, .txt or .npy file
+        gen_model: Generated voxel grid, dense, sparse, chunked or memory-mapped
         draw_comp (bool, optional): Display the read ground truth model. Defaults to False.
         tol (float, optional): MSE tolerance. Defaults to 1e-3.
         remove_gamma_correction (bool, optional): Convert sRGBA values to RGB for the voxel colors. 
@@ -152,7 +232,15 @@ def generate_comp(ref_file, gen_model, draw_comp=False, tol=1e-3, remove_gamma_c
     Returns:
         Computed IoU and MSE scores.
     """
-    grid1 = rotate_voxel_grid_for_blender(load_color_grid_from_txt(ref_file))
+    grid1 = rotate_voxel_grid_for_blender(load_reference_grid(ref_file))
+
+    # chunked and memory-mapped grids are scored from their filled voxels only
+    if isinstance(gen_model, (VoxelGrid.ChunkedVoxelGrid, VoxelGrid.MappedVoxelGrid)):
+        gen_model = gen_model.to_sparse()
+
+    if isinstance(gen_model, VoxelGrid.SparseVoxelGrid):
+        return generate_sparse_comp(grid1, gen_model, draw_comp, tol, remove_gamma_correction)
+
     grid2 = gen_model.colors
 
     if remove_gamma_correction:
@@ -165,11 +253,11 @@ def generate_comp(ref_file, gen_model, draw_comp=False, tol=1e-3, remove_gamma_c
     alpha1 = grid1[..., 3]
     alpha2 = grid2[..., 3]
 
-    occupied1 = alpha1 == 1.0
-    occupied2 = alpha2 == 1.0
+    occupied1 = occupancy.pack(alpha1 == 1.0)
+    occupied2 = occupancy.pack(alpha2 == 1.0)
 
-    intersection = np.logical_and(occupied1, occupied2).sum()
-    union = np.logical_or(occupied1, occupied2).sum()
+    intersection = occupancy.count(occupied1 & occupied2)
+    union = occupancy.count(occupied1 | occupied2)
 
     iou = intersection / union if union > 0 else 0.0
 
@@ -179,3 +267,31 @@ def generate_comp(ref_file, gen_model, draw_comp=False, tol=1e-3, remove_gamma_c
         generate_mesh.generate_mesh_from_grid(grid1, obj_name="Ref obj", mesh_name="Ref mesh")
 
     return iou, mse
+
+def generate_sparse_comp(grid1, gen_model, draw_comp=False, tol=1e-3, remove_gamma_correction=True):
+    """Score a sparse generated grid against the ground truth grid, without expanding it.
+
+    Args:
+        grid1: Rotated ground truth grid
+        gen_model (SparseVoxelGrid): Generated sparse grid
+        draw_comp (bool, optional): Display the read ground truth model. Defaults to False.
+        tol (float, optional): MSE tolerance. Defaults to 1e-3.
+        remove_gamma_correction (bool, optional): Convert sRGBA values to RGB for the voxel colors. 
+        Defaults to True.
+
+    Returns:
+        Computed IoU and MSE scores.
+    """
+    ref = hollow_out_grid(VoxelGrid.SparseVoxelGrid.from_colors(grid1))
+
+    assert ref.shape == gen_model.shape, "Grid shapes must match"
+
+    palette = srgb_to_linear(gen_model.palette) if remove_gamma_correction else gen_model.palette
+    gen = VoxelGrid.SparseVoxelGrid(*gen_model.shape, gen_model.keys, gen_model.indices, palette)
+
+    iou, mse = compute_sparse_scores(ref, gen, tol=tol)
+
+    if draw_comp:
+        generate_mesh.generate_mesh_from_grid(ref, obj_name="Ref obj", mesh_name="Ref mesh")
+
+    return iou, mse
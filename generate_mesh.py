@@ -2,145 +2,386 @@
 This module generates the voxel model as an object in the Blender viewport.
 """
 import bpy
-import bmesh
 import numpy as np
-from mathutils import Vector, Matrix
+from . import VoxelGrid, mesher
+
+# name of the color attribute and the material that reads it
+COLOR_ATTRIBUTE = "VoxelColor"
+COLOR_MATERIAL = "VoxelColorMaterial"
+
+# material and geometry nodes group of the instanced point display
+INSTANCE_MATERIAL = "VoxelInstanceMaterial"
+INSTANCE_NODE_GROUP = "VoxelInstances"
+
+# pooled per-color materials are named after their color, rounded to this many decimals
+MATERIAL_PREFIX = "VoxelMat_"
+MATERIAL_DECIMALS = 4
 
 def srgb_to_linear(c):
     """Convert sRGB values to linear RGB, important for displaying the right colors in Blender 
     for comparison.
 
     Args:
-        c: converted color value
+        c: converted color value, or an array of colors with one color per row
     """
-    c = c / 255.0 if c.max() > 1.0 else c  
+    c = np.asarray(c, dtype=float)[..., :3]
+    c = np.where(c.max(axis=-1, keepdims=True) > 1.0, c / 255.0, c)
     result = np.where(
         c <= 0.04045,
         c / 12.92,
         ((c + 0.055) / 1.055) ** 2.4
     )
-    return tuple(result[:3])
+    return result
+
+def fill_mesh(mesh, vertices, faces, material_indices):
+    """Write vertex and face arrays into an empty Blender mesh, without going through
+    Python lists.
+
+    Args:
+        mesh: Empty mesh to fill
+        vertices: Array of vertex positions, one row per vertex
+        faces: Array of vertex indices, one row of four per quad
+        material_indices: Material index of each face
+    """
+    mesh.vertices.add(len(vertices))
+    mesh.vertices.foreach_set("co", np.asarray(vertices, dtype=np.float32).ravel())
+
+    mesh.loops.add(faces.size)
+    mesh.loops.foreach_set("vertex_index", np.asarray(faces, dtype=np.int32).ravel())
+
+    mesh.polygons.add(len(faces))
+    mesh.polygons.foreach_set("loop_start", np.arange(0, faces.size, 4, dtype=np.int32))
+    mesh.polygons.foreach_set("material_index", np.asarray(material_indices, dtype=np.int32))
+
+    mesh.update(calc_edges=True)
+
+def add_color_attribute(mesh, colors, domain='CORNER'):
+    """Store colors as a color attribute of the mesh.
+
+    Args:
+        mesh: Mesh with its geometry filled in
+        colors: Array of linear RGB colors, one row per face for the 'CORNER' domain
+        and one row per vertex for the 'POINT' domain
+        domain (str, optional): Attribute domain. Defaults to 'CORNER'.
+    """
+    attribute = mesh.color_attributes.new(name=COLOR_ATTRIBUTE, type='FLOAT_COLOR', domain=domain)
+
+    # every corner of a face gets the color of the face
+    repeats = 4 if domain == 'CORNER' else 1
+    element_colors = np.ones((len(colors), repeats, 4), dtype=np.float32)
+    element_colors[:, :, :3] = colors[:, None, :]
+    attribute.data.foreach_set("color", element_colors.ravel())
+
+    mesh.color_attributes.active_color_name = COLOR_ATTRIBUTE
+    mesh.color_attributes.default_color_name = COLOR_ATTRIBUTE
+
+def color_attribute_material():
+    """Get the material that shades faces with their color attribute, creating it on
+    first use. All voxel objects share it. Its viewport color is left at the default, so 
+    Solid shading only shows the voxel colors with its Color set to Attribute.
+
+    Returns:
+        The material.
+    """
+    mat = bpy.data.materials.get(COLOR_MATERIAL)
+    if mat is not None:
+        return mat
+
+    mat = bpy.data.materials.new(name=COLOR_MATERIAL)
+    mat.use_nodes = True
+    nodes = mat.node_tree.nodes
+    nodes.clear()
+
+    attribute = nodes.new('ShaderNodeVertexColor')
+    attribute.layer_name = COLOR_ATTRIBUTE
+    bsdf = nodes.new('ShaderNodeBsdfPrincipled')
+    output = nodes.new('ShaderNodeOutputMaterial')
+
+    mat.node_tree.links.new(attribute.outputs['Color'], bsdf.inputs['Base Color'])
+    mat.node_tree.links.new(bsdf.outputs['BSDF'], output.inputs['Surface'])
+
+    return mat
 
-def add_cube(bm, location, size, material_index):
-    """Add a voxel as a cube mesh at the specified location, with the given size and material that 
-    determines the voxel color.
+def palette_materials(palette):
+    """Get one material for each palette color from the material pool. Materials are keyed 
+    by their color, so colors that were used before reuse their material instead of creating 
+    a new one.
 
     Args:
-        bm: Mesh to add cube geometry to (voxel object mesh)
-        location: Location of cube placement
-        size (float): Voxel size
-        material_index: Index of material that is assigned to this cube; 
-        unique materials are precomputed
+        palette: Array of linear RGB colors
+
+    Returns:
+        List of materials, one per palette color.
     """
-    before_faces = set(bm.faces)
-    bmesh.ops.create_cube(bm, size=size, matrix=Matrix.Translation(location))
-    new_faces = set(bm.faces) - before_faces
+    pool = {mat.name: mat for mat in bpy.data.materials if mat.name.startswith(MATERIAL_PREFIX)}
+    materials = []
+
+    for r, g, b in np.round(palette, MATERIAL_DECIMALS):
+        name = f"{MATERIAL_PREFIX}{r:.{MATERIAL_DECIMALS}f}_{g:.{MATERIAL_DECIMALS}f}_{b:.{MATERIAL_DECIMALS}f}"
+        mat = pool.get(name)
+
+        if mat is None:
+            mat = bpy.data.materials.new(name=name)
+            mat.use_nodes = False
+            mat.diffuse_color = (r, g, b, 1)
+            pool[name] = mat
+
+        materials.append(mat)
 
-    for face in new_faces:
-        face.material_index = material_index
+    return materials
 
-def center_object_to_grid(obj, grid_size):
+def free_unused_materials(materials):
+    """
+    Remove the materials that no object data uses anymore.
     """
-    After computing the object mesh, center the object at position 0,0,0 in world space.
+    for mat in set(materials):
+        if mat.users == 0:
+            bpy.data.materials.remove(mat)
+
+def occupied_voxels(colors):
+    """Collect the non-transparent voxels of a grid, in x, y, z order.
+
+    Args:
+        colors: Voxel grid colors, or a dense or sparse grid
+
+    Returns:
+        Shape of the grid, the (x, y, z) coordinates of the voxels and their colors.
     """
-    center = (grid_size - 1) / 2.0
-    offset = (-center, -center, -center)
+    if isinstance(colors, VoxelGrid.SparseVoxelGrid):
+        occupied = colors.occupied()
+        return colors.shape, np.column_stack(colors.coords())[occupied], colors.voxel_colors()[occupied]
+
+    if isinstance(colors, VoxelGrid.VoxelGrid):
+        # look the voxels up through the palette, without expanding the colors
+        palette = np.asarray(colors.palette)
+        positions = np.argwhere((palette[:, 3] != 0)[colors.indices])
+        indices = colors.indices[positions[:, 0], positions[:, 1], positions[:, 2]]
+        return colors.indices.shape, positions, palette[indices]
+
+    occupied = colors[..., 3] != 0
+    return colors.shape[:3], np.argwhere(occupied), colors[occupied]
+
+def voxel_palette(voxel_colors, remove_gamma_correction=True):
+    """Index the voxel colors into a palette of display colors.
+
+    Args:
+        voxel_colors: Array of RGBA colors, one row per voxel
+        remove_gamma_correction (bool, optional): Use sRGB to RGB conversion. Defaults to True.
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    Returns:
+        Palette of RGB colors, and the palette index of each voxel.
+    """
+    unique_colors, color_index = np.unique(voxel_colors.reshape(-1, 4), axis=0, return_inverse=True)
+    palette = unique_colors[:, :3]
 
-    for v in obj.data.vertices:
-        v.co.x += offset[0]
-        v.co.y += offset[1]
-        v.co.z += offset[2]
+    if remove_gamma_correction:
+        palette = srgb_to_linear(palette)
 
-    obj.location = (0, 0, 0)
+    return palette, color_index.reshape(-1)
 
 def generate_mesh_from_grid(colors,
                             voxel_size=1.0,
                             remove_gamma_correction=True,
+                            greedy=False,
+                            color_mode='MATERIALS',
                             obj_name="VoxelObject",
                             mesh_name="VoxelMesh"):
 
     """Generates the voxel mesh from the 3D colors array.
 
     Args:
-        colors: Voxel grid
+        colors: Voxel grid colors, or a dense or sparse grid
         voxel_size (float, optional): Size of voxels (cubes in the mesh). Defaults to 1.0.
         remove_gamma_correction (bool, optional): Use sRGB to RGB conversion. Defaults to True.
+        greedy (bool, optional): Merge neighbouring coplanar faces of the same color into 
+        larger quads. Defaults to False.
+        color_mode (str, optional): 'MATERIALS' creates one material per color, 'COLOR_ATTRIBUTE' 
+        stores the colors in a color attribute shaded by a single material. Defaults to 'MATERIALS'.
         obj_name (str, optional): Name of generated object. Defaults to "VoxelObject".
         mesh_name (str, optional): Name of generated mesh. Defaults to "VoxelMesh".
 
     Returns:
         Generated voxel object.
     """
-    remove_existing_mesh(obj_name)
+    # the old materials are kept until the new mesh has taken the ones it still needs
+    old_materials = remove_existing_mesh(obj_name)
 
-    width, height, depth, _ = colors.shape
+    shape, positions, voxel_colors = occupied_voxels(colors)
 
     mesh = bpy.data.meshes.new(mesh_name)
     obj = bpy.data.objects.new(obj_name, mesh)
     bpy.context.collection.objects.link(obj)
-    bm = bmesh.new()
 
     obj.data.materials.clear()
 
-    unique_colors = np.unique(colors.reshape(-1, 4), axis=0)
-    color_to_index = {}
-    materials = []
+    palette, color_index = voxel_palette(voxel_colors, remove_gamma_correction)
 
-    for i, c in enumerate(unique_colors):
-        color = c
+    if color_mode == 'COLOR_ATTRIBUTE':
+        obj.data.materials.append(color_attribute_material())
+    else:
+        for mat in palette_materials(palette):
+            obj.data.materials.append(mat)
 
-        if remove_gamma_correction:
-            color = srgb_to_linear(c[:3])
+    # only the exposed faces are built, with corners shared between neighbouring voxels
+    vertices, faces, face_voxels = mesher.build_surface(positions, shape, color_index if greedy else None)
 
-        r, g, b = color
+    # voxel (x, y, z) is a cube of voxel_size around (x, y, z) * voxel_size, and the grid is centered
+    center = (shape[0] - 1) / 2.0
+    vertices = (vertices - 0.5) * voxel_size - center
 
-        mat = bpy.data.materials.new(name=f"Mat_{i}")
-        mat.use_nodes = False
-        mat.diffuse_color = (r, g, b, 1)
+    if color_mode == 'COLOR_ATTRIBUTE':
+        fill_mesh(mesh, vertices, faces, np.zeros(len(faces), dtype=np.int32))
+        add_color_attribute(mesh, palette[color_index[face_voxels]])
+    else:
+        fill_mesh(mesh, vertices, faces, color_index[face_voxels])
 
-        obj.data.materials.append(mat)
-        color_to_index[tuple(np.round(color[:3], 4))] = i
-        materials.append(mat)
+    free_unused_materials(old_materials)
+
+    bpy.context.view_layer.objects.active = obj
+    obj.select_set(True)
 
-    # add cube meshes to obj
-    for x in range (width):
-        for y in range (height):
-            for z in range (depth):
-                color = colors[x, y, z]
-                if color[3] == 0:
-                    continue
+    return obj
 
-                material_index = color_to_index[tuple(np.round((srgb_to_linear(color))[:3], 4))]
-                add_cube(bm,
-                        Vector((x * 1.0 * voxel_size, y * 1.0 * voxel_size, z * 1.0 * voxel_size)),
-                        voxel_size,
-                        material_index)
+def instance_material():
+    """Get the material that shades cube instances with the color attribute of their point,
+    creating it on first use.
 
-    bm.to_mesh(mesh)
-    bm.free()
+    Returns:
+        The material.
+    """
+    mat = bpy.data.materials.get(INSTANCE_MATERIAL)
+    if mat is not None:
+        return mat
 
-    bpy.context.view_layer.objects.active = obj
-    obj.select_set(True)
+    mat = bpy.data.materials.new(name=INSTANCE_MATERIAL)
+    mat.use_nodes = True
+    nodes = mat.node_tree.nodes
+    nodes.clear()
+
+    attribute = nodes.new('ShaderNodeAttribute')
+    attribute.attribute_type = 'INSTANCER'
+    attribute.attribute_name = COLOR_ATTRIBUTE
+    bsdf = nodes.new('ShaderNodeBsdfPrincipled')
+    output = nodes.new('ShaderNodeOutputMaterial')
+
+    mat.node_tree.links.new(attribute.outputs['Color'], bsdf.inputs['Base Color'])
+    mat.node_tree.links.new(bsdf.outputs['BSDF'], output.inputs['Surface'])
+
+    return mat
+
+def instance_node_group():
+    """Get the geometry nodes group that instances a cube on every point, creating it on
+    first use. The cube size is the "Voxel Size" input of the group.
+
+    Returns:
+        The node group.
+    """
+    group = bpy.data.node_groups.get(INSTANCE_NODE_GROUP)
+    if group is not None:
+        return group
+
+    group = bpy.data.node_groups.new(INSTANCE_NODE_GROUP, 'GeometryNodeTree')
+    group.interface.new_socket(name="Geometry", in_out='INPUT', socket_type='NodeSocketGeometry')
+    group.interface.new_socket(name="Voxel Size", in_out='INPUT', socket_type='NodeSocketFloat')
+    group.interface.new_socket(name="Geometry", in_out='OUTPUT', socket_type='NodeSocketGeometry')
+
+    nodes = group.nodes
+    links = group.links
+    group_input = nodes.new('NodeGroupInput')
+    group_output = nodes.new('NodeGroupOutput')
+    cube = nodes.new('GeometryNodeMeshCube')
+    set_material = nodes.new('GeometryNodeSetMaterial')
+    set_material.inputs['Material'].default_value = instance_material()
+    instance = nodes.new('GeometryNodeInstanceOnPoints')
+
+    links.new(group_input.outputs['Voxel Size'], cube.inputs['Size'])
+    links.new(cube.outputs['Mesh'], set_material.inputs['Geometry'])
+    links.new(group_input.outputs['Geometry'], instance.inputs['Points'])
+    links.new(set_material.outputs['Geometry'], instance.inputs['Instance'])
+    links.new(instance.outputs['Instances'], group_output.inputs['Geometry'])
+
+    return group
+
+def generate_points_from_grid(colors,
+                              voxel_size=1.0,
+                              remove_gamma_correction=True,
+                              obj_name="VoxelObject",
+                              mesh_name="VoxelMesh"):
+    """Generates a quick display of the grid, as one point per voxel with a cube instanced 
+    on every point by a geometry nodes modifier. Memory and build time grow with the voxel 
+    count only, so this is meant for previewing large grids.
+
+    Args:
+        colors: Voxel grid colors, or a dense or sparse grid
+        voxel_size (float, optional): Size of voxels (instanced cubes). Defaults to 1.0.
+        remove_gamma_correction (bool, optional): Use sRGB to RGB conversion. Defaults to True.
+        obj_name (str, optional): Name of generated object. Defaults to "VoxelObject".
+        mesh_name (str, optional): Name of generated mesh. Defaults to "VoxelMesh".
 
-    center_object_to_grid(obj, width)
+    Returns:
+        Generated voxel object.
+    """
+    old_materials = remove_existing_mesh(obj_name)
+
+    shape, positions, voxel_colors = occupied_voxels(colors)
+
+    # every point carries its own color, so no palette is needed
+    point_colors = voxel_colors[:, :3]
+    if remove_gamma_correction:
+        point_colors = srgb_to_linear(point_colors)
+
+    mesh = bpy.data.meshes.new(mesh_name)
+    obj = bpy.data.objects.new(obj_name, mesh)
+    bpy.context.collection.objects.link(obj)
+
+    # points sit at the voxel centers, placed like the cubes of the full mesh
+    center = (shape[0] - 1) / 2.0
+    mesh.vertices.add(len(positions))
+    mesh.vertices.foreach_set("co", (positions * voxel_size - center).astype(np.float32).ravel())
+    mesh.update()
+
+    add_color_attribute(mesh, point_colors, domain='POINT')
+
+    group = instance_node_group()
+    modifier = obj.modifiers.new(name="VoxelInstances", type='NODES')
+    modifier.node_group = group
+    modifier[group.interface.items_tree["Voxel Size"].identifier] = voxel_size
 
-    bpy.ops.object.mode_set(mode='EDIT')
-    bpy.ops.mesh.select_all(action='SELECT')\
+    free_unused_materials(old_materials)
 
-    # clean up
-    bpy.ops.mesh.remove_doubles(threshold=0.001)
-    bpy.ops.mesh.normals_make_consistent(inside=False)
-    bpy.ops.object.mode_set(mode='OBJECT')
+    bpy.context.view_layer.objects.active = obj
+    obj.select_set(True)
 
     return obj
 
 def remove_existing_mesh(name="VoxelObject"):
+    """Remove object and mesh geometry. The mesh is freed as well once nothing else uses it,
+    so regenerating does not leave orphan meshes behind.
+
+    Args:
+        name (str, optional): Name of the object. Defaults to "VoxelObject".
+
+    Returns:
+        Materials of the removed mesh, for the caller to free once they are unused.
+    """
+    obj = bpy.data.objects.get(name)
+    if obj is None:
+        return []
+
+    mesh = obj.data
+    bpy.data.objects.remove(obj, do_unlink=True)
+
+    if mesh is None:
+        return []
+
+    materials = [mat for mat in mesh.materials if mat is not None]
+    if mesh.users == 0:
+        bpy.data.meshes.remove(mesh)
+
+    return materials
+
+def delete_mesh_object(name="VoxelObject"):
     """
-    Remove object and mesh geometry.
+    Remove an object together with its mesh and the materials nothing else uses.
     """
-    obj_name = name
-    if obj_name in bpy.data.objects:
-        obj = bpy.data.objects[obj_name]
-        bpy.data.objects.remove(obj, do_unlink=True)
+    free_unused_materials(remove_existing_mesh(name))
@@ -0,0 +1,163 @@
+"""
+This module builds the surface mesh of a voxel grid as plain vertex and face arrays. It only
+depends on NumPy, so meshes can be built and checked outside of Blender as well.
+"""
+import numpy as np
+
+# outward normal of each cube face, and its corners in counter-clockwise order seen from outside
+FACES = (
+    ((1, 0, 0), ((1, 0, 0), (1, 1, 0), (1, 1, 1), (1, 0, 1))),
+    ((-1, 0, 0), ((0, 0, 0), (0, 0, 1), (0, 1, 1), (0, 1, 0))),
+    ((0, 1, 0), ((0, 1, 0), (0, 1, 1), (1, 1, 1), (1, 1, 0))),
+    ((0, -1, 0), ((0, 0, 0), (1, 0, 0), (1, 0, 1), (0, 0, 1))),
+    ((0, 0, 1), ((0, 0, 1), (1, 0, 1), (1, 1, 1), (0, 1, 1))),
+    ((0, 0, -1), ((0, 0, 0), (0, 1, 0), (1, 1, 0), (1, 0, 0))),
+)
+
+# largest padded grid whose occupancy is looked up in a dense mask instead of sorted keys
+DENSE_LOOKUP_LIMIT = 258 ** 3
+
+def _strides(shape):
+    """
+    Key strides of a C-ordered array with the given shape.
+    """
+    return np.array([shape[1] * shape[2], shape[2], 1], dtype=np.int64)
+
+def exposed_faces(positions, shape):
+    """Find the faces of each voxel that do not touch another voxel. Faces on the border
+    of the grid are always exposed.
+
+    Args:
+        positions: Array of (x, y, z) voxel coordinates, one row per occupied voxel
+        shape: Shape of the grid
+
+    Returns:
+        List of boolean masks over the voxels, one for each direction in FACES.
+    """
+    positions = np.asarray(positions, dtype=np.int64).reshape(-1, 3)
+    if len(positions) == 0:
+        return [np.zeros(0, dtype=bool) for _ in FACES]
+
+    # a padded key never wraps into another row, so neighbour keys can be looked up directly
+    padded = tuple(size + 2 for size in shape)
+    strides = _strides(padded)
+    keys = (positions + 1) @ strides
+    offsets = [np.dot(normal, strides) for normal, _ in FACES]
+
+    if np.prod(padded, dtype=np.int64) <= DENSE_LOOKUP_LIMIT:
+        volume = np.zeros(np.prod(padded), dtype=bool)
+        volume[keys] = True
+        return [~volume[keys + offset] for offset in offsets]
+
+    sorted_keys = np.sort(keys)
+    exposed = []
+
+    for offset in offsets:
+        neighbours = keys + offset
+        found = np.searchsorted(sorted_keys, neighbours).clip(max=len(keys) - 1)
+        exposed.append(sorted_keys[found] != neighbours)
+
+    return exposed
+
+def _runs(keys, labels, step=1):
+    """Split sorted faces into runs of faces with the same label whose keys are one step apart.
+
+    Returns:
+        Index of the first face of each run, and the run length.
+    """
+    starts = np.ones(len(keys), dtype=bool)
+    starts[1:] = (np.diff(keys) != step) | (labels[1:] != labels[:-1])
+    first = np.flatnonzero(starts)
+
+    return first, np.diff(np.append(first, len(keys)))
+
+def merge_faces(origins, labels, voxels, axis, shape):
+    """Greedily merge the faces of one direction into rectangles of faces with the same label.
+    Faces are first joined into runs along the last in-plane axis, then runs with the same
+    start, length and label are stacked along the other in-plane axis.
+
+    Args:
+        origins: Array of (x, y, z) voxel coordinates of the faces
+        labels: Label of each face, only faces with equal labels are merged
+        voxels: Voxel index of each face
+        axis (int): Axis the faces point along
+        shape: Shape of the grid
+
+    Returns:
+        Voxel index, origin and (x, y, z) extent of each rectangle.
+    """
+    if len(origins) == 0:
+        return voxels, origins, np.ones_like(origins)
+
+    v, u = (a for a in range(3) if a != axis)
+
+    # one spare position per row, so a run never continues into the next row
+    keys = (origins[:, axis] * shape[v] + origins[:, v]) * (shape[u] + 1) + origins[:, u]
+    order = np.argsort(keys, kind='stable')
+    first, length_u = _runs(keys[order], labels[order])
+    run = order[first]
+
+    # stack runs that match in everything but their row
+    order = np.lexsort((origins[run, v], labels[run], length_u, origins[run, u], origins[run, axis]))
+    rows = origins[run[order], v]
+    same = np.ones(len(order), dtype=bool)
+    for key in (origins[run, axis], origins[run, u], length_u, labels[run]):
+        same[1:] &= key[order][1:] == key[order][:-1]
+
+    first, length_v = _runs(rows, np.cumsum(~same))
+    rectangle = order[first]
+
+    extents = np.ones((len(rectangle), 3), dtype=np.int64)
+    extents[:, u] = length_u[rectangle]
+    extents[:, v] = length_v
+
+    return voxels[run[rectangle]], origins[run[rectangle]], extents
+
+def build_surface(positions, shape, labels=None):
+    """Build the quads of all exposed voxel faces. Vertices are shared between the faces
+    that meet at them, and every face is wound counter-clockwise seen from outside.
+
+    Args:
+        positions: Array of (x, y, z) voxel coordinates, one row per occupied voxel
+        shape: Shape of the grid
+        labels (optional): Label of each voxel. When given, neighbouring coplanar faces 
+        with the same label are merged into larger quads. Defaults to None.
+
+    Returns:
+        Integer vertex coordinates on the voxel corner lattice, where voxel (x, y, z) spans
+        the corners (x, y, z) to (x + 1, y + 1, z + 1), the (n, 4) array of vertex indices
+        of each face, and the voxel each face belongs to.
+    """
+    positions = np.asarray(positions, dtype=np.int64).reshape(-1, 3)
+    corners = []
+    face_voxels = []
+
+    for mask, (normal, offsets) in zip(exposed_faces(positions, shape), FACES):
+        voxels = np.flatnonzero(mask)
+        origins = positions[voxels]
+        extents = np.ones_like(origins)
+
+        if labels is not None:
+            axis = int(np.flatnonzero(normal)[0])
+            voxels, origins, extents = merge_faces(origins, labels[voxels], voxels, axis, shape)
+
+        corners.append(origins[:, None, :] + np.array(offsets)[None, :, :] * extents[:, None, :])
+        face_voxels.append(voxels)
+    corners = np.concatenate(corners)
+    face_voxels = np.concatenate(face_voxels)
+
+    # deduplicate the corners through their key on the corner lattice
+    lattice = tuple(size + 1 for size in shape)
+    corner_keys = corners.reshape(-1, 3) @ _strides(lattice)
+
+    if np.prod(lattice, dtype=np.int64) <= DENSE_LOOKUP_LIMIT:
+        used = np.zeros(np.prod(lattice), dtype=bool)
+        used[corner_keys] = True
+        keys = np.flatnonzero(used)
+        faces = (np.cumsum(used) - 1)[corner_keys]
+    else:
+        keys, faces = np.unique(corner_keys, return_inverse=True)
+
+    vertices = np.column_stack(np.unravel_index(keys, lattice))
+
+    return vertices, faces.reshape(-1, 4), face_voxels
@@ -0,0 +1,124 @@
+"""
+This module implements bit-packed occupancy masks, with one bit per voxel or pixel. Masks are
+packed along their last axis with np.packbits, so the other axes can still be sliced and
+broadcast like in the unpacked mask.
+"""
+import numpy as np
+
+# number of set bits in every byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def packed_shape(shape):
+    """
+    Shape of the packed version of a mask with the given shape.
+    """
+    return tuple(shape[:-1]) + ((shape[-1] + 7) // 8,)
+
+def pack(mask):
+    """Pack a boolean mask along its last axis.
+
+    Args:
+        mask: Boolean array
+
+    Returns:
+        Array of uint8 words, eight positions per word.
+    """
+    return np.packbits(mask, axis=-1)
+
+def unpack(packed, size):
+    """Unpack a mask packed with pack.
+
+    Args:
+        packed: Packed mask
+        size (int): Size of the last axis of the unpacked mask
+
+    Returns:
+        Boolean array.
+    """
+    return np.unpackbits(packed, axis=-1, count=size).view(bool)
+
+def pack_broadcast(mask, shape):
+    """Pack a mask that broadcasts to the given shape, without expanding it first. Masks
+    that are constant along the last axis are packed as whole words.
+
+    Args:
+        mask: Boolean array, broadcastable to shape
+        shape: Shape of the unpacked mask
+
+    Returns:
+        Read-only packed mask with the packed shape.
+    """
+    if mask.shape[-1] == 1 and shape[-1] != 1:
+        packed = np.where(mask, pack(np.ones(shape[-1], dtype=bool)), np.uint8(0))
+    else:
+        packed = pack(mask)
+
+    return np.broadcast_to(packed, packed_shape(shape))
+
+def count(packed):
+    """
+    Number of set positions in a packed mask.
+    """
+    return int(POPCOUNT[packed].sum(dtype=np.int64))
+
+def at_least(masks, k, shape):
+    """Positions that are set in at least k of the packed masks.
+
+    Args:
+        masks: Packed masks, broadcastable to a common packed shape
+        k (int): Number of masks a position has to be set in
+        shape: Shape of the unpacked masks
+
+    Returns:
+        Packed mask.
+    """
+    if k <= 0:
+        return np.full(packed_shape(shape), 0xff, dtype=np.uint8)
+
+    # reached[j] holds the positions that are set in more than j of the masks so far
+    reached = [np.zeros(packed_shape(shape), dtype=np.uint8) for _ in range(k)]
+    for mask in masks:
+        for j in range(k - 1, 0, -1):
+            reached[j] |= reached[j - 1] & mask
+        reached[0] |= mask
+
+    return reached[k - 1]
+
+def shift(packed, axis, offset, size):
+    """Shift a packed mask so that every position holds the value of its neighbour at
+    the given offset. Positions whose neighbour lies outside the mask are cleared.
+
+    Args:
+        packed: Packed mask
+        axis (int): Axis to shift along
+        offset (int): Neighbour offset, -1 or 1 along the packed last axis
+        size (int): Size of the last axis of the unpacked mask
+
+    Returns:
+        Shifted packed mask.
+    """
+    axis = axis % packed.ndim
+    shifted = np.zeros_like(packed)
+
+    if axis != packed.ndim - 1:
+        length = packed.shape[axis]
+        source = [slice(None)] * packed.ndim
+        target = [slice(None)] * packed.ndim
+        source[axis] = slice(max(offset, 0), length + min(offset, 0))
+        target[axis] = slice(max(-offset, 0), length + min(-offset, 0))
+        shifted[tuple(target)] = packed[tuple(source)]
+        return shifted
+
+    # bits are stored most significant first, a carry moves between neighbouring words
+    if offset == 1:
+        shifted[...] = packed << 1
+        shifted[..., :-1] |= packed[..., 1:] >> 7
+    elif offset == -1:
+        shifted[...] = packed >> 1
+        shifted[..., 1:] |= packed[..., :-1] << 7
+    else:
+        raise ValueError(f"Packed axis can only be shifted by one, got {offset}")
+
+    # keep the padding bits of the last word clear
+    shifted[..., -1] &= pack(np.ones(size, dtype=bool))[-1]
+    return shifted
@@ -61,6 +61,10 @@ class GenerateGrid(Operator):
             self.report({'ERROR'}, "No algorithm selected")
             return {'CANCELLED'}
 
+        if settings.export_format != 'NONE' and not settings.export_path:
+            self.report({'ERROR'}, "No export path set")
+            return {'CANCELLED'}
+
         utils.generate_voxel_grid(context)
 
         self.report({'INFO'}, 'Dids it')    
@@ -37,19 +37,19 @@ class PanelSettings(PropertyGroup):
     width: IntProperty(
         name="Width",
         min = 1,
-        max = 256
+        max = 1024
     ) # type: ignore
 
     height: IntProperty(
         name="Height",
         min = 1,
-        max = 256
+        max = 1024
     ) # type: ignore
 
     depth: IntProperty(
         name="Depth",
         min = 1,
-        max = 256
+        max = 1024
     ) # type: ignore
 
     voxel_size: FloatProperty(
@@ -58,6 +58,38 @@ class PanelSettings(PropertyGroup):
         min = 0.1
     ) # type: ignore
 
+    display_mode: EnumProperty(
+        name="Display",
+        description="Build the full voxel mesh, or instance a cube on one point per voxel for a quick preview",
+        items=presets.display_modes,
+        default='MESH'
+    ) # type: ignore
+
+    greedy_meshing: BoolProperty(
+        name="Greedy Meshing",
+        description="Merge neighbouring faces of the same color into larger quads",
+        default=False
+    ) # type: ignore
+
+    coloring_mode: EnumProperty(
+        name="Coloring",
+        description="Color the voxels with one material per color, or with a color attribute under a single material",
+        items=presets.coloring_modes,
+        default='MATERIALS'
+    ) # type: ignore
+
+    export_format: EnumProperty(
+        name="Export",
+        description="Also write the generated grid to a file, as a compressed .npz grid or a memory-mapped grid file",
+        items=presets.export_formats,
+        default='NONE'
+    ) # type: ignore
+
+    export_path: StringProperty(
+        name="Export Path",
+        subtype='FILE_PATH'
+    ) # type: ignore
+
     # silhouette intersect
     threshold: FloatProperty(
         name="Threshold",
@@ -206,6 +238,15 @@ class MainMenu(Panel):
         box.prop(settings, "height")
         box.prop(settings, "depth")
         box.prop(settings, "voxel_size")
+        box.prop(settings, "display_mode")
+        if settings.display_mode == 'MESH':
+            box.prop(settings, "greedy_meshing")
+            box.prop(settings, "coloring_mode")
+            if settings.coloring_mode == 'COLOR_ATTRIBUTE':
+                box.label(text="Solid view shows colors with Color set to Attribute", icon='INFO')
+        box.prop(settings, "export_format")
+        if settings.export_format != 'NONE':
+            box.prop(settings, "export_path")
 
         box = layout.box()
         box.label(text="Method")
@@ -23,3 +23,21 @@ merging_techniques = [
     ('NEAREST_PROJ', "Nearest Projection", ""),
     ('MAJORITY_VOTE', "Majority Vote", "")
 ]
+
+coloring_modes = [
+    ('MATERIALS', "Material per Color", ""),
+    ('COLOR_ATTRIBUTE', "Color Attribute", "Store the voxel colors in a color attribute shaded by one material. "
+                                           "Solid shading shows them with its Color set to Attribute, "
+                                           "with Color set to Material the voxels are gray")
+]
+
+display_modes = [
+    ('MESH', "Mesh", ""),
+    ('POINTS', "Instanced Points", "")
+]
+
+export_formats = [
+    ('NONE', "None", ""),
+    ('NPZ', "Voxel Grid (.npz)", ""),
+    ('MAPPED', "Memory-Mapped Grid", "")
+]
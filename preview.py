@@ -1,8 +1,9 @@
 """Show the loaded images preview. 
 """
-from . import VoxelGrid
+import numpy as np
+from . import VoxelGrid, projection
 
-def show_all_sides(images, width, height, depth):
+def show_all_sides(images, width, height, depth, chunk_size=None):
     """Generates a grid showing the input images before any intersections.
 
     Args:
@@ -10,33 +11,26 @@ def show_all_sides(images, width, height, depth):
         width (int): Set width
         height (int): Set height
         depth (int): Set depth
+        chunk_size (int, optional): Paint into a chunked grid with chunks of this size. 
+        Defaults to None, which returns a dense grid.
 
     Returns:
-        _type_: _description_
+        The 3D grid with the images painted on its faces
     """
-    voxel_grid = VoxelGrid.VoxelGrid(width, height, depth)
+    if chunk_size:
+        voxel_grid = VoxelGrid.ChunkedVoxelGrid(width, height, depth, chunk_size)
+    else:
+        voxel_grid = VoxelGrid.VoxelGrid(width, height, depth)
 
-    for x in range (width):
-        for z in range (height):
-            for y in range (depth):
+    def paint(xs, ys, zs, face):
+        xs, ys, zs = (c.reshape(-1) for c in np.broadcast_arrays(xs, ys, zs))
+        voxel_grid.set_voxels(xs, ys, zs, face.reshape(len(xs), -1))
 
-                #front view
-                if(y == 0) and 'FRONT' in images:
-                    voxel_grid.set_color(x, y, z, images['FRONT'][z, x])
-                #back view
-                elif(y == depth - 1) and 'BACK' in images:
-                    voxel_grid.set_color(x, y, z, images['BACK'][z, width - 1 - x])
-                #left view
-                elif(x == 0) and 'LEFT' in images:
-                    voxel_grid.set_color(x, y, z, images['LEFT'][z, depth - 1 - y])
-                #right view
-                elif(x == width - 1) and 'RIGHT' in images:
-                    voxel_grid.set_color(x, y, z, images['RIGHT'][z, y])
-                #top view
-                elif(z == height - 1) and 'TOP' in images:
-                    voxel_grid.set_color(x, y, z, images['TOP'][y, x])
-                #bottom view
-                elif(z == 0) and 'BOTTOM' in images:
-                    voxel_grid.set_color(x, y, z, images['BOTTOM'][depth - 1 - y, x])
+    # paint the faces from lowest to highest priority, so that shared edges 
+    # end up with the color of the first view in front, back, left, right, top, bottom
+    for view in reversed(projection.VIEWS):
+        if view in images:
+            row, col = projection.ray_pixels(view, width, height, depth)
+            paint(*projection.face_coords(view, width, height, depth), images[view][row, col])
 
     return voxel_grid
@@ -0,0 +1,177 @@
+"""
+This module implements the projections between the voxel grid and the six orthographic view images.
+Voxels are indexed as (x, y, z), where y runs over the depth and z over the height of the grid.
+"""
+from functools import lru_cache
+import numpy as np
+from . import VoxelGrid
+
+VIEWS = ('FRONT', 'BACK', 'LEFT', 'RIGHT', 'TOP', 'BOTTOM')
+
+# grid axis each view looks along (x, y = depth, z = height), and whether its scan runs backwards
+DEPTH_SCAN = {
+    'FRONT': (1, False),
+    'BACK': (1, True),
+    'LEFT': (0, False),
+    'RIGHT': (0, True),
+    'TOP': (2, True),
+    'BOTTOM': (2, False),
+}
+
+def grid_sizes(width, height, depth):
+    """
+    Size of the grid along the x, y and z axes.
+    """
+    return (width, depth, height)
+
+def region_coords(region):
+    """Broadcastable coordinates of the voxels in a block of the grid.
+
+    Args:
+        region: Tuple of x, y and z slices
+
+    Returns:
+        Coordinate arrays, one per axis.
+    """
+    sx, sy, sz = region
+    x = np.arange(sx.start, sx.stop)[:, None, None]
+    y = np.arange(sy.start, sy.stop)[None, :, None]
+    z = np.arange(sz.start, sz.stop)[None, None, :]
+
+    return x, y, z
+
+def grid_coords(width, height, depth):
+    """
+    Broadcastable coordinates of all voxels of the grid.
+    """
+    return region_coords(tuple(slice(0, size) for size in grid_sizes(width, height, depth)))
+
+def pixel_coords(view, x, y, z, width, depth):
+    """Pixel (row, column) of the view image that projects onto voxel (x, y, z).
+
+    Args:
+        view (string): View direction
+        x, y, z: Voxel coordinates, as scalars or broadcastable arrays
+        width (int): Set width
+        depth (int): Set depth
+
+    Returns:
+        Row and column of the pixel, broadcast like the coordinates.
+    """
+    if view == 'FRONT':
+        return z, x
+    if view == 'BACK':
+        return z, width - 1 - x
+    if view == 'LEFT':
+        return z, depth - 1 - y
+    if view == 'RIGHT':
+        return z, y
+    if view == 'TOP':
+        return y, x
+    return depth - 1 - y, x
+
+def region_pixels(view, region, width, depth):
+    """Window of the view image that a block of the grid projects onto.
+
+    Args:
+        view (string): View direction
+        region: Tuple of x, y and z slices
+        width (int): Set width
+        depth (int): Set depth
+
+    Returns:
+        Row and column slices of the image.
+    """
+    first = pixel_coords(view, *(s.start for s in region), width, depth)
+    last = pixel_coords(view, *(s.stop - 1 for s in region), width, depth)
+
+    return tuple(slice(min(a, b), max(a, b) + 1) for a, b in zip(first, last))
+
+def covering_views(images, views, region, width, depth):
+    """Number of views whose silhouette reaches a block of the grid. Voxels of the block
+    can be covered by at most this many silhouettes.
+    """
+    return sum(bool(np.any(images[view][region_pixels(view, region, width, depth)][..., 3] > 0))
+               for view in views)
+
+def fill_grid(images, views, fill_region, required, width, height, depth, hollow_grid=False, chunk_size=None):
+    """Fill a grid from the views, with the voxels and colors that fill_region returns.
+
+    Args:
+        images: Images of the views
+        views: Views that are used
+        fill_region: Function from the broadcastable coordinates of a block of the grid 
+        to the coordinates and colors of the filled voxels in it
+        required (int): Number of silhouettes a voxel has to be in to be filled, blocks 
+        that fewer silhouettes reach are skipped
+        width (int): Set width
+        height (int): Set height
+        depth (int): Set depth
+        hollow_grid (bool, optional): Hollow out the filled grid. Defaults to False.
+        chunk_size (int, optional): Fill the grid in chunks of this size and return a 
+        chunked grid. Defaults to None, which returns a dense grid.
+
+    Returns:
+        Dense or chunked grid.
+    """
+    if chunk_size:
+        voxel_grid = VoxelGrid.ChunkedVoxelGrid(width, height, depth, chunk_size)
+    else:
+        voxel_grid = VoxelGrid.VoxelGrid(width, height, depth)
+
+    # dense grids are filled block by block as well, so the colors gathered by the fill 
+    # never span the whole grid
+    for _, region in VoxelGrid.grid_regions((width, height, depth), chunk_size or VoxelGrid.CHUNK_SIZE):
+        # blocks that too few silhouettes reach stay empty
+        if covering_views(images, views, region, width, depth) < required:
+            continue
+        voxel_grid.set_voxels(*fill_region(*region_coords(region)))
+
+    return voxel_grid.hollow_out() if hollow_grid else voxel_grid
+
+def _read_only(*arrays):
+    for array in arrays:
+        array.flags.writeable = False
+    return arrays
+
+@lru_cache(maxsize=64)
+def ray_pixels(view, width, height, depth):
+    """Pixel of the view image for each ray of the view, where a ray is a line of voxels
+    along the axis the view looks along.
+
+    Args:
+        view (string): View direction
+        width (int): Set width
+        height (int): Set height
+        depth (int): Set depth
+
+    Returns:
+        Read-only row and column arrays with the shape of the grid, except for the view
+        axis, which has size 1.
+    """
+    axis, _ = DEPTH_SCAN[view]
+    coords = list(grid_coords(width, height, depth))
+    coords[axis] = np.zeros((1, 1, 1), dtype=int)
+
+    row, col = np.broadcast_arrays(*pixel_coords(view, *coords, width, depth))
+    return _read_only(row.copy(), col.copy())
+
+@lru_cache(maxsize=64)
+def face_coords(view, width, height, depth):
+    """Coordinates of the voxels on the face of the grid that is closest to the view,
+    one per ray, in the same layout as ray_pixels.
+
+    Args:
+        view (string): View direction
+        width (int): Set width
+        height (int): Set height
+        depth (int): Set depth
+
+    Returns:
+        Read-only broadcastable x, y and z arrays.
+    """
+    axis, reverse = DEPTH_SCAN[view]
+    coords = list(grid_coords(width, height, depth))
+    coords[axis] = np.full((1, 1, 1), grid_sizes(width, height, depth)[axis] - 1 if reverse else 0)
+
+    return _read_only(*coords)
@@ -1,8 +1,24 @@
 """
 This module implements the silhouette intersection algorithm. 
 """
+import math
 import numpy as np
-from . import VoxelGrid, depth_map
+from . import depth_map, color_merge, occupancy, projection
+
+def _behind_depth(view, x, y, z, view_depth):
+    """Mask of voxels that lie at or behind the estimated depth, as seen from the view.
+    """
+    if view == 'FRONT':
+        return y >= view_depth
+    if view == 'BACK':
+        return y <= view_depth
+    if view == 'LEFT':
+        return x >= view_depth
+    if view == 'RIGHT':
+        return x <= view_depth
+    if view == 'TOP':
+        return z <= view_depth
+    return z >= view_depth
 
 def project_min_dist(images,
                         width,
@@ -16,7 +32,8 @@ def project_min_dist(images,
                         factor = 1,
                         min_region_size=5,
                         keep_concave_regions=True,
-                        hollow_grid=False):
+                        hollow_grid=False,
+                        chunk_size=None):
     """Apply silhouette intersection to generate the grid from the passed images.
 
     Args:
@@ -40,148 +57,73 @@ def project_min_dist(images,
 
         hollow_grid (bool, optional): Choice for whether the model should be filled in at 
         non-visible voxel points. Defaults to False.
+        chunk_size (int, optional): Process the grid in chunks of this size and return a 
+        chunked grid. Defaults to None, which fills a dense grid in one pass.
 
     Returns:
         The 3D grid of colors representing the model
     """
-    voxel_grid = VoxelGrid.VoxelGrid(width, height, depth)
-    colors = np.full((width, height, depth, 4), [0, 0, 0, 0], dtype=float)
     depth_maps = {}
 
     if use_depth_mapping:
-        for view, image in images.items():
-            other_images = [(v, img) for v, img in images.items() if v != view]
-
-            curr_depth_map = depth_map.calculate_depth(view,
-                                                        image,
-                                                        other_images,
-                                                        width,
-                                                        height,
-                                                        depth)
-
-            final_depth_map = depth_map.estimate_using_gradients(view,
-                                                                    image,
-                                                                    curr_depth_map,
-                                                                    width,
-                                                                    height,
-                                                                    depth,
-                                                                    intensity_threshold,
-                                                                    concavity_depth,
-                                                                    factor,
-                                                                    min_region_size,
-                                                                    keep_concave_regions)
-
-            depth_maps[view] = final_depth_map
-
-    for x in range (width):
-        for y in range (depth):
-            for z in range (height):
-                candidates = []
-                available_projections = {}
-
-                # front
-                if 'FRONT' in images:
-                    front_color = images['FRONT'][z, x]
-                    if front_color[3] > 0:
-                        if use_depth_mapping:
-                            if(y >= depth_maps['FRONT'][z,x]):
-                                candidates.append(front_color)
-                                available_projections['front'] = front_color
-                        else:
-                            candidates.append(front_color)
-                            available_projections['front'] = front_color
-
-                # back
-                if 'BACK' in images:
-                    back_color = images['BACK'][z, width - 1 - x]
-                    if back_color[3] > 0:
-                        if use_depth_mapping:
-                            if(y <= depth_maps['BACK'][z,width-1-x]):
-                                candidates.append(back_color)
-                                available_projections['back'] = back_color
-                        else:
-                            candidates.append(back_color)
-                            available_projections['back'] = back_color
-
-                # left
-                if 'LEFT' in images:
-                    left_color = images['LEFT'][z, depth - 1 - y]
-                    if left_color[3] > 0:
-                        if use_depth_mapping:
-                            if(x >= depth_maps['LEFT'][z,depth-1-y]):
-                                candidates.append(left_color)
-                                available_projections['left'] = left_color
-                        else:
-                            candidates.append(left_color)
-                            available_projections['left'] = left_color
-
-                # right
-                if 'RIGHT' in images:
-                    right_color = images['RIGHT'][z, y]
-                    if right_color[3] > 0:
-                        if use_depth_mapping:
-                            if(x <= depth_maps['RIGHT'][z,y]):
-                                candidates.append(right_color)
-                                available_projections['right'] = right_color
-                        else:
-                            candidates.append(right_color)
-                            available_projections['right'] = right_color
-
-                # top
-                if 'TOP' in images:
-                    top_color = images['TOP'][y, x]
-                    if top_color[3] > 0:
-                        if use_depth_mapping:
-                            if(z <= depth_maps['TOP'][y,x]):
-                                candidates.append(top_color)
-                                available_projections['top'] = top_color
-                        else:
-                            candidates.append(top_color)
-                            available_projections['top'] = top_color
-
-                # bottom
-                if 'BOTTOM' in images:
-                    bottom_color = images['BOTTOM'][depth - 1 - y, x]
-                    if bottom_color[3] > 0:
-                        if use_depth_mapping:
-                            if(z >= depth_maps['BOTTOM'][depth-1-y,x]):
-                                candidates.append(bottom_color)
-                                available_projections['top'] = bottom_color
-                        else:
-                            candidates.append(bottom_color)
-                            available_projections['top'] = bottom_color
-
-                if len(candidates) >= (threshold * len(images)) / 1.0:
-                    final_color = []
-
-                    if merge_technique == "MAJORITY_VOTE":
-                        colors_np = np.array([c[:3] for c in candidates])
-                        unique_colors, counts = np.unique(colors_np, axis=0, return_counts=True)
-                        max_index = np.argmax(counts)
-                        final_color = list(unique_colors[max_index]) + [1.0]
-
-                    else:
-                        distances = {
-                            'front': y,
-                            'back': depth - 1 - y,
-                            'left': x,
-                            'right': width - 1 - x,
-                            'top': height - 1 - z,
-                            'bottom': z
-                        }
-                        closest_projection = min(
-                            available_projections.keys(),
-                            key=lambda k: distances[k]
-                        )
-                        final_color = available_projections[closest_projection]
-
-                    colors[x, y, z] = final_color
-
-    if hollow_grid:
-        hollow_grid = voxel_grid.hollow_out_grid(colors)
-        voxel_grid.colors = hollow_grid
-
-    else:
-        voxel_grid.colors = colors
-
-    return voxel_grid
+        depth_maps = depth_map.estimate_depth_maps(images,
+                                                   width,
+                                                   height,
+                                                   depth,
+                                                   intensity_threshold,
+                                                   concavity_depth,
+                                                   factor,
+                                                   min_region_size,
+                                                   keep_concave_regions)
+
+    views = [view for view in projection.VIEWS if view in images]
+
+    if merge_technique == "MAJORITY_VOTE":
+        palette, index_images = color_merge.build_palette({view: images[view] for view in views})
+
+    # voxels without any candidate color stay empty, even at a zero threshold
+    required = max(math.ceil((threshold * len(images)) / 1.0), 1)
+
+    def fill_region(x, y, z):
+        """Colors of the occupied voxels in the block spanned by the coordinate arrays.
+        """
+        shape = (x.shape[0], y.shape[1], z.shape[2])
+        silhouettes = []
+
+        # bit-packed candidate masks, straight from the silhouettes unless depth gates them
+        for view in views:
+            row, col = projection.pixel_coords(view, x, y, z, width, depth)
+            mask = images[view][row, col, 3] > 0
+
+            if use_depth_mapping:
+                mask = mask & _behind_depth(view, x, y, z, depth_maps[view][row, col])
+
+            silhouettes.append(occupancy.pack_broadcast(mask, shape))
+
+        occupied = occupancy.unpack(occupancy.at_least(silhouettes, required, shape), shape[2])
+
+        # gather the projected colors of the occupied voxels, one column per view
+        local = np.nonzero(occupied)
+        xs, ys, zs = x[local[0], 0, 0], y[0, local[1], 0], z[0, 0, local[2]]
+        projected = np.empty((len(xs), len(views), 4), dtype=float)
+        valid = np.empty((len(xs), len(views)), dtype=bool)
+        keys = np.empty(valid.shape, dtype=np.int64)
+
+        for i, view in enumerate(views):
+            row, col = projection.pixel_coords(view, xs, ys, zs, width, depth)
+            projected[:, i] = images[view][row, col]
+            valid[:, i] = projected[:, i, 3] > 0
+
+            if use_depth_mapping:
+                valid[:, i] &= _behind_depth(view, xs, ys, zs, depth_maps[view][row, col])
+            if merge_technique == "MAJORITY_VOTE":
+                keys[:, i] = index_images[view][row, col]
+
+        if merge_technique == "MAJORITY_VOTE":
+            return xs, ys, zs, color_merge.majority_vote(keys, valid, palette)
+
+        distances = color_merge.voxel_distances(views, xs, ys, zs, width, height, depth)
+        return xs, ys, zs, color_merge.nearest_projection(projected, valid, distances)
+
+    return projection.fill_grid(images, views, fill_region, required, width, height, depth,
+                                hollow_grid, chunk_size)
@@ -0,0 +1,101 @@
+"""
+Headless tests of the NumPy mesher. The plugin package imports bpy, so mesher.py is loaded
+straight from its file.
+"""
+import importlib.util
+import os
+import numpy as np
+import pytest
+
+spec = importlib.util.spec_from_file_location(
+    'mesher', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mesher.py'))
+mesher = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mesher)
+
+def random_grid(shape, seed, fill=0.4, colors=3):
+    rng = np.random.default_rng(seed)
+    positions = np.argwhere(rng.random(shape) < fill)
+
+    return positions, rng.integers(0, colors, len(positions))
+
+def face_normals(vertices, faces):
+    corners = vertices[faces]
+    return np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 1])
+
+def face_cells(vertices, faces):
+    """Voxel faces covered by each quad, as rows of (axis, side, voxel x, y, z), and the
+    quad each of them belongs to.
+    """
+    corners = vertices[faces]
+    normals = face_normals(vertices, faces)
+    low, high = corners.min(axis=1), corners.max(axis=1)
+    cells, owners = [], []
+
+    for face, normal in enumerate(normals):
+        axis = int(np.abs(normal).argmax())
+        side = int(np.sign(normal[axis]))
+        u, v = (a for a in range(3) if a != axis)
+
+        for i in range(low[face, u], high[face, u]):
+            for j in range(low[face, v], high[face, v]):
+                voxel = [0, 0, 0]
+                voxel[axis] = low[face, axis] - (side > 0)
+                voxel[u], voxel[v] = i, j
+                cells.append((axis, side, *voxel))
+                owners.append(face)
+
+    return np.array(cells), np.array(owners)
+
+def signed_volume(vertices, faces):
+    """Volume enclosed by the quads, positive when they are all wound outwards.
+    """
+    c = vertices[faces].astype(float)
+    volume = (np.einsum('ij,ij->i', c[:, 0], np.cross(c[:, 1], c[:, 2])) +
+              np.einsum('ij,ij->i', c[:, 0], np.cross(c[:, 2], c[:, 3])))
+
+    return volume.sum() / 6
+
+@pytest.mark.parametrize('n', [1, 2, 5])
+def test_solid_cube(n):
+    positions = np.argwhere(np.ones((n, n, n), dtype=bool))
+
+    vertices, faces, _ = mesher.build_surface(positions, (n, n, n))
+    assert len(faces) == 6 * n * n
+    assert len(vertices) == 6 * n * n + 2
+
+    vertices, faces, _ = mesher.build_surface(positions, (n, n, n), labels=np.zeros(len(positions)))
+    assert len(faces) == 6
+    assert len(vertices) == 8
+
+@pytest.mark.parametrize('greedy', [False, True])
+@pytest.mark.parametrize('seed', range(4))
+def test_random_grid(seed, greedy):
+    shape = (7, 6, 5)
+    positions, labels = random_grid(shape, seed)
+
+    vertices, faces, face_voxels = mesher.build_surface(positions, shape, labels if greedy else None)
+
+    # every vertex is used, and only once in the vertex array
+    assert len(np.unique(vertices, axis=0)) == len(vertices)
+    assert np.array_equal(np.unique(faces), np.arange(len(vertices)))
+
+    # the quads do not overlap, and together cover exactly the exposed voxel faces
+    cells, owners = face_cells(vertices, faces)
+    exposed = mesher.exposed_faces(positions, shape)
+    assert len(np.unique(cells, axis=0)) == len(cells)
+    assert len(cells) == sum(mask.sum() for mask in exposed)
+
+    # each covered face belongs to an occupied voxel, with the label of its quad
+    lookup = {tuple(p): i for i, p in enumerate(positions)}
+    voxels = np.array([lookup[tuple(cell[2:])] for cell in cells])
+    if greedy:
+        assert np.array_equal(labels[voxels], labels[face_voxels[owners]])
+    else:
+        assert np.array_equal(voxels, face_voxels[owners])
+
+    # outward winding encloses one unit of volume per voxel
+    assert signed_volume(vertices, faces) == pytest.approx(len(positions))
+
+def test_empty_grid():
+    vertices, faces, face_voxels = mesher.build_surface(np.zeros((0, 3), dtype=int), (4, 4, 4))
+    assert len(vertices) == len(faces) == len(face_voxels) == 0
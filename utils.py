@@ -35,11 +35,17 @@ def create_grid(context):
         pixels_np = np.round(pixels_np, 3)
         images_dict[img.orientation] = pixels_np
 
+    # grids past the dense limit are generated chunk by chunk
+    chunk_size = None
+    if max(settings.width, settings.height, settings.depth) > VoxelGrid.DENSE_LIMIT:
+        chunk_size = VoxelGrid.CHUNK_SIZE
+
     if settings.selected_algorithm == 'IMAGE_PREVIEW':
         grid = preview.show_all_sides(images_dict,
                                         settings.width,
                                         settings.height,
-                                        settings.depth)
+                                        settings.depth,
+                                        chunk_size)
 
     elif settings.selected_algorithm == 'SILHOUETTE_INTERSECT':
         grid = silhouette_intersect.project_min_dist(images_dict,
@@ -54,7 +60,8 @@ def create_grid(context):
                                                         settings.depth_factor,
                                                         settings.min_region_size,
                                                         settings.keep_concave_regions,
-                                                        settings.hollow_grid)
+                                                        settings.hollow_grid,
+                                                        chunk_size)
 
     elif settings.selected_algorithm == 'SPATIAL_CARVING':
         grid = carve.spatial_carve(images_dict,
@@ -65,7 +72,8 @@ def create_grid(context):
                                     settings.concavity_depth,
                                     settings.color_threshold_carve,
                                     settings.dist_threshold_carve,
-                                    settings.hollow_grid)
+                                    settings.hollow_grid,
+                                    chunk_size)
     
     elif settings.selected_algorithm == 'DEPTH_ESTIMATE':
         grid = depth_map.generate_final_grid(images_dict,
@@ -76,10 +84,29 @@ def create_grid(context):
                                                 settings.concavity_depth,
                                                 settings.depth_factor,
                                                 settings.min_region_size,
-                                                settings.keep_concave_regions)
+                                                settings.keep_concave_regions,
+                                                chunk_size)
 
     return grid
 
+def export_grid(grid, export_format, path):
+    """Write a generated grid to a file.
+
+    Args:
+        grid: Dense or chunked grid
+        export_format (string): 'NPZ' for a compressed .npz grid, read back with 
+        VoxelGrid.load_grid, or 'MAPPED' for a memory-mapped grid file, opened with 
+        VoxelGrid.MappedVoxelGrid
+        path (string): Path to the file, relative to the .blend file when it starts with //
+    """
+    path = bpy.path.abspath(path)
+
+    if export_format == 'NPZ':
+        VoxelGrid.save_grid(grid, path)
+
+    elif export_format == 'MAPPED':
+        VoxelGrid.MappedVoxelGrid.from_grid(path, grid)
+
 def generate_voxel_grid(context):
     """
     Generate Voxel object and mesh in the viewport.
@@ -88,9 +115,25 @@ def generate_voxel_grid(context):
 
     grid = create_grid(context)
 
-    obj = generate_mesh.generate_mesh_from_grid(grid.get_colors(),
-                                                voxel_size = settings.voxel_size,
-                                                remove_gamma_correction=settings.remove_gamma_correction)
+    if settings.export_format != 'NONE':
+        export_grid(grid, settings.export_format, settings.export_path)
+
+    # grids are meshed from their palette indices, chunked grids from their filled voxels only
+    if isinstance(grid, VoxelGrid.ChunkedVoxelGrid):
+        colors = grid.to_sparse()
+    else:
+        colors = grid
+
+    if settings.display_mode == 'POINTS':
+        obj = generate_mesh.generate_points_from_grid(colors,
+                                                      voxel_size = settings.voxel_size,
+                                                      remove_gamma_correction=settings.remove_gamma_correction)
+    else:
+        obj = generate_mesh.generate_mesh_from_grid(colors,
+                                                    voxel_size = settings.voxel_size,
+                                                    remove_gamma_correction=settings.remove_gamma_correction,
+                                                    greedy=settings.greedy_meshing,
+                                                    color_mode=settings.coloring_mode)
 
     settings.gen_object = obj
 
@@ -0,0 +1,156 @@
+"""
+This module reads and writes MagicaVoxel .vox files. It only depends on NumPy, so it can be
+used outside of Blender as well.
+"""
+import struct
+import numpy as np
+
+VOX_MAGIC = b'VOX '
+VOX_VERSION = 150
+
+# largest model edge and number of colors a .vox file can hold
+VOX_MAX_SIZE = 256
+VOX_MAX_COLORS = 255
+
+def default_palette():
+    """MagicaVoxel's default palette, used by files without an RGBA chunk.
+
+    Returns:
+        Array of 256 RGBA colors as uint8, indexed by voxel color index.
+    """
+    levels = [0xff, 0xcc, 0x99, 0x66, 0x33, 0x00]
+    ramp = [0xee, 0xdd, 0xbb, 0xaa, 0x88, 0x77, 0x55, 0x44, 0x22, 0x11]
+
+    # a 6x6x6 color cube without black, then blue, green, red and gray ramps
+    colors = [(r, g, b) for r in levels for g in levels for b in levels][:-1]
+    colors += [(0, 0, v) for v in ramp] + [(0, v, 0) for v in ramp]
+    colors += [(v, 0, 0) for v in ramp] + [(v, v, v) for v in ramp]
+
+    palette = np.zeros((256, 4), dtype=np.uint8)
+    palette[1:, :3] = colors
+    palette[1:, 3] = 255
+
+    return palette
+
+def _chunks(data, start, end):
+    """
+    Yield the id, content and children of every chunk between two offsets.
+    """
+    while start < end:
+        chunk_id = data[start:start + 4]
+        content_size, children_size = struct.unpack_from('<ii', data, start + 4)
+        content_start = start + 12
+        children_start = content_start + content_size
+
+        yield chunk_id, data[content_start:children_start], (children_start, children_start + children_size)
+        start = children_start + children_size
+
+def read_vox(path, normalize=True):
+    """Read the first model of a .vox file.
+
+    Args:
+        path (string): Path to the .vox file
+        normalize (bool, optional): Return the palette as floats in [0.0, 1.0] instead of
+        uint8 values. Defaults to True.
+
+    Returns:
+        Palette of RGBA colors with the empty color at index 0, and the (x, y, z) array
+        of palette indices.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if data[:4] != VOX_MAGIC:
+        raise ValueError(f"{path} is not a .vox file")
+
+    main = next(_chunks(data, 8, len(data)))
+    if main[0] != b'MAIN':
+        raise ValueError(f"{path} has no MAIN chunk")
+
+    size = None
+    voxels = None
+    palette = default_palette()
+
+    for chunk_id, content, _ in _chunks(data, *main[2]):
+        if chunk_id == b'SIZE' and size is None:
+            size = struct.unpack_from('<3i', content)
+        elif chunk_id == b'XYZI' and voxels is None:
+            count = struct.unpack_from('<i', content)[0]
+            voxels = np.frombuffer(content, dtype=np.uint8, count=count * 4, offset=4).reshape(-1, 4)
+        elif chunk_id == b'RGBA':
+            # palette entry i holds color index i + 1
+            palette = np.zeros((256, 4), dtype=np.uint8)
+            palette[1:] = np.frombuffer(content, dtype=np.uint8, count=255 * 4).reshape(-1, 4)
+
+    if size is None or voxels is None:
+        raise ValueError(f"{path} has no model")
+
+    indices = np.zeros(size, dtype=np.uint8)
+    indices[voxels[:, 0], voxels[:, 1], voxels[:, 2]] = voxels[:, 3]
+
+    if normalize:
+        palette = palette.astype(np.float32) / 255.0
+
+    return palette, indices
+
+def quantize_palette(colors, max_colors=VOX_MAX_COLORS):
+    """Reduce a set of colors to the most frequent ones. Every other color is replaced
+    by its closest kept color.
+
+    Args:
+        colors: Array of RGBA colors as uint8, one row per voxel
+        max_colors (int, optional): Largest number of colors to keep. Defaults to VOX_MAX_COLORS.
+
+    Returns:
+        Palette of kept colors, and the index into it for every voxel.
+    """
+    unique, inverse, counts = np.unique(colors, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    if len(unique) <= max_colors:
+        return unique, inverse
+
+    kept = np.sort(np.argsort(-counts, kind='stable')[:max_colors])
+    palette = unique[kept].astype(np.int64)
+
+    nearest = np.empty(len(unique), dtype=np.int64)
+    for start in range(0, len(unique), 4096):
+        block = unique[start:start + 4096].astype(np.int64)
+        distances = ((block[:, None, :] - palette[None, :, :]) ** 2).sum(axis=2)
+        nearest[start:start + 4096] = np.argmin(distances, axis=1)
+
+    return unique[kept], nearest[inverse]
+
+def write_vox(path, palette, indices):
+    """Write a grid as a single model .vox file. Transparent voxels are left out, and grids
+    with more than 255 colors are quantized to the 255 most frequent ones.
+
+    Args:
+        path (string): Path to the .vox file
+        palette: Palette of RGBA colors as floats in [0.0, 1.0]
+        indices: (x, y, z) array of palette indices
+    """
+    if max(indices.shape) > VOX_MAX_SIZE:
+        raise ValueError(f"Grid of shape {indices.shape} does not fit a .vox model, "
+                         f"the largest edge is {VOX_MAX_SIZE}")
+
+    palette = np.clip(np.round(np.asarray(palette, dtype=float) * 255), 0, 255).astype(np.uint8)
+    xs, ys, zs = np.nonzero(palette[indices, 3] != 0)
+    colors, color_index = quantize_palette(palette[indices[xs, ys, zs]])
+
+    voxels = np.empty((len(xs), 4), dtype=np.uint8)
+    voxels[:, 0], voxels[:, 1], voxels[:, 2] = xs, ys, zs
+    voxels[:, 3] = color_index + 1
+
+    rgba = np.zeros((256, 4), dtype=np.uint8)
+    rgba[:len(colors)] = colors
+
+    def chunk(chunk_id, content):
+        return chunk_id + struct.pack('<ii', len(content), 0) + content
+
+    children = (chunk(b'SIZE', struct.pack('<3i', *indices.shape)) +
+                chunk(b'XYZI', struct.pack('<i', len(voxels)) + voxels.tobytes()) +
+                chunk(b'RGBA', rgba.tobytes()))
+
+    with open(path, 'wb') as f:
+        f.write(VOX_MAGIC + struct.pack('<i', VOX_VERSION))
+        f.write(b'MAIN' + struct.pack('<ii', 0, len(children)) + children)